@@ -30,7 +30,9 @@ def make_default_config():
         "GroundObjectsWhenMoving": "False",
         "GroundObjectsWhenAdding": "True",
         "wasdscrolling_speed": "200",
-        "wasdscrolling_speedupfactor": "3"
+        "wasdscrolling_speedupfactor": "3",
+        "archivecache_mb": "256",
+        "gen_read_workers": "1"
     }
     cfg["model render"] = {
         "Width": "2000",
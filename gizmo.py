@@ -2,6 +2,7 @@ from OpenGL.GL import *
 
 from lib.model_rendering import Model
 from lib.vectors import Vector3, Plane
+from lib.objectstore import get_average_position
 from widgets.editor_widgets import catch_exception
 
 id_to_meshname = {
@@ -55,22 +56,7 @@ class Gizmo(Model):
             return
         self.hidden = False
 
-        avgx = None
-        avgy = None
-        avgz = None
-
-        for obj in objects:
-            if avgx is None:
-                avgx = obj.position.x
-                avgy = obj.position.y
-                avgz = obj.position.z
-            else:
-                avgx += obj.position.x
-                avgy += obj.position.y
-                avgz += obj.position.z
-        self.position.x = avgx / len(objects)
-        self.position.y = avgy / len(objects)
-        self.position.z = avgz / len(objects)
+        self.position.x, self.position.y, self.position.z = get_average_position(objects)
         #print("New position is", self.position, len(objects))
 
     def render_collision_check(self, scale, is3d=True, rotation=True):
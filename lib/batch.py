@@ -0,0 +1,431 @@
+import os
+import sys
+import time
+import json
+import hashlib
+from io import StringIO
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+from lib.yaz0 import decompress_prefix, get_decompressed_size, CompressionCache, DEFAULT_LEVEL
+from lib.sarc import SARCArchive
+from lib.rarc import Archive
+from lib.vfs import ArchiveFS
+from lib.fileio import write_files, DEFAULT_IO_THREADS
+from lib.libgen import GeneratorFile, MIN_PARALLEL_SIZE
+
+# Extract and pack every SARC and RARC archive in a directory tree, e.g. a full game dump.
+# Archives are handled in separate processes, the files of an archive are written to disk by a thread pool.
+# The build mode keeps a manifest of the files in each _ext folder and only repacks the archives whose files changed.
+# Extracting records which archives were Yaz0 compressed so that packing compresses the same archives again.
+# The generators mode reads every generator file in every archive, e.g. to check that all of them can be read.
+
+ARCHIVE_EXTENSIONS = (".szs", ".arc", ".carc", ".sarc", ".rarc")
+MANIFEST_NAME = "build_manifest.json"
+ARCHIVE_INFO_NAME = "archive_info.json"
+# Text files in archives that aren't generator files
+NOT_GENERATORS = ("path.txt", "camera.txt")
+
+
+def get_archive_type(path):
+    # Returns b"SARC" or b"RARC" for the archive at path (compressed or not), None for anything else
+    with open(path, "rb") as f:
+        header = f.read(4)
+        if header == b"Yaz0":
+            f.seek(0)
+            header = decompress_prefix(f, 4)
+
+    if header in (b"SARC", b"RARC"):
+        return header
+    else:
+        return None
+
+
+def is_compressed(path):
+    with open(path, "rb") as f:
+        return f.read(4) == b"Yaz0"
+
+
+def get_archive_size(path):
+    # Size of the archive at path when uncompressed
+    with open(path, "rb") as f:
+        header = f.read(16)
+        if header[0:4] == b"Yaz0":
+            return get_decompressed_size(header)
+        else:
+            return os.fstat(f.fileno()).st_size
+
+
+def find_archives(path, extensions=ARCHIVE_EXTENSIONS):
+    archives = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        # Don't go into folders of previously extracted archives
+        dirnames[:] = sorted(dirname for dirname in dirnames if not dirname.endswith("_ext"))
+
+        for filename in sorted(filenames):
+            if filename.lower().endswith(extensions):
+                archives.append(os.path.join(dirpath, filename))
+    return archives
+
+
+def find_extracted_folders(path):
+    folders = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        for dirname in sorted(dirnames):
+            if dirname.endswith("_ext"):
+                folders.append(os.path.join(dirpath, dirname))
+        dirnames[:] = sorted(dirname for dirname in dirnames if not dirname.endswith("_ext"))
+    return folders
+
+
+def get_output_path(path, inputroot, outputroot, suffix):
+    # Output goes next to the input unless there is an output root, in which case the tree is mirrored there
+    if outputroot is None:
+        return path + suffix
+    else:
+        return os.path.join(outputroot, os.path.relpath(path, inputroot)) + suffix
+
+
+def extract_archive(inputpath, outputpath, threads=DEFAULT_IO_THREADS, verbose=False):
+    # Returns the size of the uncompressed archive, the time it took to extract it and whether it was Yaz0 compressed
+    start = time.time()
+    log = sys.stdout if verbose else StringIO()
+
+    with redirect_stdout(log):
+        vfs = ArchiveFS()
+        files = [(os.path.join(outputpath, path), data) for path, data in vfs.iter_files(inputpath)]
+        write_files(files, threads)
+
+    return vfs.size(), time.time() - start, is_compressed(inputpath)
+
+
+def pack_archive(inputpath, outputpath, level=DEFAULT_LEVEL, cachepath=None, verbose=False, compress=None):
+    # Packs an extracted folder back into an archive. The archive type is taken from the original archive if
+    # it still exists, otherwise a folder that contains only a single folder is assumed to be a RARC archive.
+    # The archive is Yaz0 compressed if compress is True. If compress is None, it is compressed if the original
+    # archive was, and if there is no original archive if it has a .szs ending.
+    # Returns the size of the uncompressed archive and the time it took to pack it.
+    start = time.time()
+    log = sys.stdout if verbose else StringIO()
+    cache = CompressionCache(cachepath) if cachepath is not None else None
+
+    with redirect_stdout(log):
+        if os.path.isfile(outputpath):
+            archivetype = get_archive_type(outputpath)
+            if compress is None:
+                compress = is_compressed(outputpath)
+        else:
+            archivetype = None
+        if compress is None:
+            compress = outputpath.lower().endswith(".szs")
+
+        entries = list(os.scandir(inputpath))
+        if archivetype is None:
+            if len(entries) == 1 and entries[0].is_dir():
+                archivetype = b"RARC"
+            else:
+                archivetype = b"SARC"
+
+        if archivetype == b"RARC":
+            if len(entries) != 1 or not entries[0].is_dir():
+                raise RuntimeError("Directory {0} should contain exactly one folder.".format(inputpath))
+
+            archive = Archive.from_dir(entries[0].path)
+            with open(outputpath, "wb") as f:
+                if compress:
+                    archive.write_arc_compressed(f, level, 1, cache)
+                else:
+                    archive.write_arc(f)
+        else:
+            archive = SARCArchive.from_folder(inputpath)
+            with open(outputpath, "wb") as f:
+                archive.to_file(f, compress=compress, level=level, cache=cache)
+
+    return get_archive_size(outputpath), time.time() - start
+
+
+def is_generator_file(path):
+    filename = path.split("/")[-1].lower()
+    return filename.endswith(".txt") and filename not in NOT_GENERATORS
+
+
+def read_generator_text(data, workers=1):
+    text = bytes(data).decode("shift-jis-2004", errors="replace")
+    return GeneratorFile.from_file(StringIO(text), workers=workers)
+
+
+def read_generators(inputpath, min_parallel_size=MIN_PARALLEL_SIZE, verbose=False):
+    # Reads every generator file in the archive. Files of min_parallel_size bytes or more are left out so they
+    # can be read afterwards with all workers, running those in this process would only use one core.
+    # Returns the size of the uncompressed archive, the time it took, the number of objects that were read
+    # and the paths of the large files that were left out.
+    start = time.time()
+    log = sys.stdout if verbose else StringIO()
+    count = 0
+    large = []
+
+    with redirect_stdout(log):
+        vfs = ArchiveFS()
+        for path, data in vfs.iter_files(inputpath):
+            if not is_generator_file(path):
+                continue
+
+            if len(data) >= min_parallel_size:
+                large.append(inputpath + "/" + path)
+            else:
+                count += len(read_generator_text(data).generators)
+
+    return vfs.size(), time.time() - start, count, large
+
+
+def run_jobs(function, jobs, workers):
+    # Runs function(*args) for every (name, args) in jobs on a process pool and prints the throughput
+    # of each job as it finishes, followed by a summary. function has to return the size of the data it
+    # handled and how long it took, anything it returns after that is collected in the result dictionary.
+    # Returns the number of jobs that failed and the result dictionary that maps job names to those results.
+    start = time.time()
+    total_size = 0
+    failed = 0
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(function, *args): name for name, args in jobs}
+
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                size, duration, *results[name] = future.result()
+            except Exception as error:
+                print("{0}: failed: {1}".format(name, error))
+                failed += 1
+                continue
+
+            total_size += size
+            print("{0}: {1:.2f} MB in {2:.2f}s, {3:.2f} MB/s".format(
+                name, size/1000000, duration, size/1000000/max(duration, 1e-6)))
+
+    duration = time.time() - start
+    print("Total: {0} archives ({1} failed), {2:.2f} MB in {3:.2f}s, {4:.2f} MB/s".format(
+        len(jobs), failed, total_size/1000000, duration, total_size/1000000/max(duration, 1e-6)))
+
+    return failed, results
+
+
+def scan_folder(path):
+    # Maps the path of every file in the folder (relative to it) to its size and modification time,
+    # without reading any of the files.
+    files = {}
+    pending = [(path, "")]
+    while pending:
+        dirpath, relpath = pending.pop()
+        for entry in os.scandir(dirpath):
+            if entry.is_dir():
+                pending.append((entry.path, relpath + entry.name + "/"))
+            elif entry.is_file():
+                stat = entry.stat()
+                files[relpath + entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return files
+
+
+def get_file_stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def hash_file(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def load_manifest(path):
+    # The manifest maps each _ext folder (relative to the input root) to the size and modification time
+    # of every file in it with the file's hash, the compression level and the size and modification time
+    # of the archive it was packed into.
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(path, manifest):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def get_compression(archive_info, key):
+    # Whether the archive of the _ext folder key was Yaz0 compressed when it was extracted,
+    # None if it wasn't extracted by this tool
+    info = archive_info.get(key)
+    if info is None:
+        return None
+    return info["compressed"]
+
+
+def is_unchanged(entry, files, outputpath, level):
+    # Only compares sizes and modification times, nothing is read
+    if entry is None or entry["level"] != level:
+        return False
+    if entry["output"] != get_file_stat(outputpath):
+        return False
+    if len(entry["files"]) != len(files):
+        return False
+
+    for relpath, (size, mtime) in files.items():
+        if relpath not in entry["files"]:
+            return False
+        oldsize, oldmtime, hash = entry["files"][relpath]
+        if oldsize != size or oldmtime != mtime:
+            return False
+
+    return True
+
+
+def build_archive(inputpath, outputpath, files, entry, level=DEFAULT_LEVEL, cachepath=None, verbose=False, compress=None):
+    # Hashes the files whose size or modification time changed since the last build and repacks the archive
+    # unless all hashes are still the same, e.g. if files were only touched.
+    # Returns the size of the uncompressed archive, how long it took and the new manifest entry.
+    start = time.time()
+    oldfiles = entry["files"] if entry is not None else {}
+    newfiles = {}
+    changed = (entry is None or entry["level"] != level or entry["output"] != get_file_stat(outputpath)
+               or set(oldfiles) != set(files))
+
+    for relpath, (size, mtime) in files.items():
+        old = oldfiles.get(relpath)
+        if old is not None and old[0] == size and old[1] == mtime:
+            hash = old[2]
+        else:
+            hash = hash_file(os.path.join(inputpath, relpath))
+            if old is None or old[2] != hash:
+                changed = True
+        newfiles[relpath] = [size, mtime, hash]
+
+    if changed:
+        size, duration = pack_archive(inputpath, outputpath, level, cachepath, verbose, compress)
+    else:
+        size = 0
+
+    newentry = {"files": newfiles, "level": level, "output": get_file_stat(outputpath)}
+    return size, time.time() - start, newentry
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Extract every archive in a directory tree into <archive>_ext folders, "
+                    "or pack every <archive>_ext folder in a directory tree back into an archive.")
+    parser.add_argument("mode", choices=("extract", "pack", "build", "generators"),
+                        help="build is like pack but only repacks archives whose _ext folder changed since the last build, "
+                             "generators reads every generator file in the archives")
+    parser.add_argument("input",
+                        help="Directory tree that contains the archives to extract or the _ext folders to pack.")
+    parser.add_argument("output", default=None, nargs='?',
+                        help="Directory in which the input tree is mirrored. By default the output is written next to the input.")
+    parser.add_argument("--workers", default=os.cpu_count(), type=int,
+                        help="How many archives are handled at the same time in separate processes. Default is the number of CPU cores")
+    parser.add_argument("--io_threads", default=DEFAULT_IO_THREADS, type=int,
+                        help="How many threads write the files of an archive when extracting. Default is {0}".format(DEFAULT_IO_THREADS))
+    parser.add_argument("--level", default=DEFAULT_LEVEL, type=int,
+                        help="Yaz0 compression level for compressed archives from 0 (no compression) to 9 (smallest output). Default is {0}".format(DEFAULT_LEVEL))
+    parser.add_argument("--cache", default=None,
+                        help="Directory of a cache for Yaz0 compressed data, repacking unchanged archives then skips compression")
+    parser.add_argument("--manifest", default=None,
+                        help="Where build keeps the state of the last build. Default is {0} in the input directory".format(MANIFEST_NAME))
+    parser.add_argument("--verbose", action="store_true",
+                        help="Show the output of the archive readers and writers")
+
+    args = parser.parse_args()
+    inputroot = os.path.normpath(args.input)
+
+    jobs = []
+    if args.mode == "extract":
+        outputroot = os.path.normpath(args.output) if args.output is not None else inputroot
+        keys = {}
+        for path in find_archives(inputroot):
+            outputpath = get_output_path(path, inputroot, args.output, "_ext")
+            keys[path] = os.path.relpath(outputpath, outputroot).replace(os.sep, "/")
+            jobs.append((path, (path, outputpath, args.io_threads, args.verbose)))
+
+        failed, results = run_jobs(extract_archive, jobs, args.workers)
+
+        # Archives from earlier extractions into the same tree keep their entries
+        os.makedirs(outputroot, exist_ok=True)
+        archive_info_path = os.path.join(outputroot, ARCHIVE_INFO_NAME)
+        archive_info = load_manifest(archive_info_path)
+        for path, (compressed, ) in results.items():
+            archive_info[keys[path]] = {"compressed": compressed}
+        save_manifest(archive_info_path, archive_info)
+    elif args.mode == "pack":
+        archive_info = load_manifest(os.path.join(inputroot, ARCHIVE_INFO_NAME))
+        for path in find_extracted_folders(inputroot):
+            outputpath = get_output_path(path[:-4], inputroot, args.output, "")
+            key = os.path.relpath(path, inputroot).replace(os.sep, "/")
+            if args.output is not None:
+                os.makedirs(os.path.dirname(outputpath), exist_ok=True)
+            jobs.append((path, (path, outputpath, args.level, args.cache, args.verbose,
+                                get_compression(archive_info, key))))
+
+        failed, results = run_jobs(pack_archive, jobs, args.workers)
+    elif args.mode == "generators":
+        for path in find_archives(inputroot):
+            jobs.append((path, (path, MIN_PARALLEL_SIZE, args.verbose)))
+
+        failed, results = run_jobs(read_generators, jobs, args.workers)
+        count = sum(result[0] for result in results.values())
+
+        # Large files are read one after another, each of them with all workers
+        vfs = ArchiveFS()
+        for archivepath, (archivecount, large) in sorted(results.items()):
+            for path in large:
+                start = time.time()
+                try:
+                    with redirect_stdout(sys.stdout if args.verbose else StringIO()):
+                        genfile = read_generator_text(vfs.read(path), args.workers)
+                except Exception as error:
+                    print("{0}: failed: {1}".format(path, error))
+                    failed += 1
+                    continue
+                count += len(genfile.generators)
+                print("{0}: {1} objects in {2:.2f}s".format(path, len(genfile.generators), time.time() - start))
+
+        print("{0} generator objects read".format(count))
+    else:
+        manifestpath = args.manifest if args.manifest is not None else os.path.join(inputroot, MANIFEST_NAME)
+        manifest = load_manifest(manifestpath)
+        archive_info = load_manifest(os.path.join(inputroot, ARCHIVE_INFO_NAME))
+        newmanifest = {}
+        skipped = 0
+
+        for path in find_extracted_folders(inputroot):
+            outputpath = get_output_path(path[:-4], inputroot, args.output, "")
+            key = os.path.relpath(path, inputroot).replace(os.sep, "/")
+            entry = manifest.get(key)
+            files = scan_folder(path)
+
+            if is_unchanged(entry, files, outputpath, args.level):
+                newmanifest[key] = entry
+                skipped += 1
+            else:
+                if args.output is not None:
+                    os.makedirs(os.path.dirname(outputpath), exist_ok=True)
+                jobs.append((key, (path, outputpath, files, entry, args.level, args.cache, args.verbose,
+                                   get_compression(archive_info, key))))
+
+        print("{0} archives unchanged".format(skipped))
+        failed = 0
+        if jobs:
+            failed, results = run_jobs(build_archive, jobs, args.workers)
+            for key, (newentry, ) in results.items():
+                newmanifest[key] = newentry
+
+        save_manifest(manifestpath, newmanifest)
+
+    sys.exit(1 if failed else 0)
@@ -1,5 +1,5 @@
 import sys 
-from yaz0 import compress_fast as compress
+from yaz0 import compress
 from io import BytesIO
 
 inputfile = sys.argv[1]
@@ -0,0 +1,57 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Reading and writing many small files, like the files of an archive, with a pool of threads.
+# Results always come back in the order of the input no matter which thread finishes first.
+
+DEFAULT_IO_THREADS = 8
+
+
+def _map(function, items, threads):
+    if threads <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    # Items are handed to the threads in batches, one task per item costs more than reading a small file
+    batch_size = max(1, len(items) // (threads*4))
+    batches = [items[i:i+batch_size] for i in range(0, len(items), batch_size)]
+
+    def run_batch(batch):
+        return [function(item) for item in batch]
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = []
+        for batch_results in executor.map(run_batch, batches):
+            results.extend(batch_results)
+        return results
+
+
+def read_file(path):
+    # Returns the content of the file at path, or None if it can't be read because permission was denied
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except PermissionError:
+        print("Permission denied:", path, "skipping...")
+        return None
+
+
+def read_files(paths, threads=DEFAULT_IO_THREADS):
+    # Returns the contents of the files in the same order as paths
+    return _map(read_file, paths, threads)
+
+
+def write_file(item):
+    path, data = item
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def write_files(files, threads=DEFAULT_IO_THREADS):
+    # files is a list of (path, data) where data is anything that supports the buffer protocol.
+    # Directories are created up front so that the threads only have to write the files.
+    # Files without a directory in their path go into the current directory which already exists.
+    for dirpath in sorted(set(os.path.dirname(path) for path, data in files)):
+        if dirpath:
+            os.makedirs(dirpath, exist_ok=True)
+
+    _map(write_file, files, threads)
@@ -1,14 +1,30 @@
 from collections import OrderedDict
 from copy import deepcopy
+from io import StringIO
+from concurrent.futures import ProcessPoolExecutor
+import gc
+import re
 
 import sys
+from sys import intern
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
 from lib.vectors import Vector3
 
 
+# Comments start with # or // and go to the end of the line
+COMMENT = re.compile("(#|//).*")
+
+# Lines that end objects without a spline. To read a file in multiple processes it is cut after some of them.
+NO_SPLINE = re.compile("^[ \t]*\"no[-_]spline\"[ \t\r]*$", re.M)
+
+# Smaller files are always read in one process
+MIN_PARALLEL_SIZE = 1024*1024
+
+
 class GenSyntaxError(Exception):
     def __init__(self, message, data):
+        super().__init__(message, data)  # Keeps the error picklable for reading in multiple processes
         self.message = message
         self.data = data
 
@@ -24,6 +40,14 @@ def syntax_assert(check, msg, line, token=None):
         raise GenSyntaxError(msg, data={"line": line, "value": token})
 
 
+def parse_vector3f(val):
+    floats = val.split(" ")
+    if len(floats) != 3:
+        raise RuntimeError("Tried to read Vector3f but got {0}".format(floats))
+
+    return float(floats[0]), float(floats[1]), float(floats[2])
+
+
 class GeneratorWriter(object):
     def __init__(self, file):
         self.f = file
@@ -32,16 +56,13 @@ class GeneratorWriter(object):
         self.indent = 0
 
     def write_token(self, token, comment = None):
-        self.f.write(self.indent*"\t")
-        self.f.write(token)
-
         if comment is not None:
             if not comment.startswith("//") and not comment.startswith("#"):
                 raise RuntimeError("Comment started with invalid character: {0}".format(comment))
-            self.f.write(" ")
-            self.f.write(comment)
+            self.f.write(self.indent*"\t" + token + " " + comment + "\n")
+        else:
+            self.f.write(self.indent*"\t" + token + "\n")
 
-        self.f.write("\n")
         self.current_line += 1
 
     def write_comment(self, comment):
@@ -98,76 +119,171 @@ class GeneratorWriter(object):
 class GeneratorReader(object):
     def __init__ (self, file):
         self.f = file
-        self.current_line = 0
 
         self._didremovecomments = False
 
-    def read_token(self):
-        self.f.tell()  # <--- EXTREMELY IMPORTANT, do not remove or bugs will appear on parsing
-        line = self.f.readline()
-        #print("pos", hex(curr), "Line", line)
-        #print(hex(self.f.tell()))
-        self.current_line += 1
-        if not line:
-            return ""
-        line = line.strip()
-        comment = line.find("#")
-
-        if comment != -1:
-            line = line[:comment]
-            self._didremovecomments = True
-
-        comment2 = line.find("//")
-        if comment2 != -1:
-            line = line[:comment2]
+        # The rest of the file is read and split into tokens in one go: comments are cut off, every line
+        # is stripped and blank lines are dropped, so reading a token is just a step forward in the token list.
+        # The line numbers of the tokens are only worked out when they are needed for an error message.
+        self._text = file.read()
+        text, comments = COMMENT.subn("", self._text)
+        if comments > 0:
             self._didremovecomments = True
 
-        if line.strip() == "":
-            line = self.read_token()  # Try reading the next token
+        # Tokens are interned so the same parameter names and values in different objects and files share one string
+        self._tokens = list(map(intern, filter(None, map(str.strip, text.split("\n")))))
+        self._linenumbers = None
+        self._index = 0
+
+    def _get_line_numbers(self):
+        # Number of the line every token is on
+        lines = COMMENT.sub("", self._text).split("\n")
+        if lines and lines[-1] == "":
+            lines.pop()
+        return [i for i, line in enumerate(lines, 1) if line.strip()], len(lines)
+
+    @property
+    def current_line(self):
+        # Line of the last token that was read. Past the end of the file every read counts as one more line.
+        if self._linenumbers is None:
+            self._linenumbers, self._linecount = self._get_line_numbers()
+
+        if self._index == 0:
+            return 0
+        elif self._index <= len(self._tokens):
+            return self.get_line(self._index-1)
+        else:
+            return self._linecount + self._index - len(self._tokens)
 
-        return line.strip()
+    def read_token(self):
+        index = self._index
+        self._index = index + 1
+        try:
+            return self._tokens[index]
+        except IndexError:
+            return ""
 
     def peek_token(self):
-        #print("next is a peek")
-        curr = self.f.tell()
-        currline = self.current_line
-        next_token = self.read_token()
-        self.current_line = currline
-
-        self.f.seek(curr)
-        #print(curr, self.f.tell())
-        assert curr == self.f.tell()
-        #print("peek done, result:", next_token)
-        return next_token
+        if self._index < len(self._tokens):
+            return self._tokens[self._index]
+        else:
+            return ""
 
     def read_section_rest_raw(self):
-        curr = f.tell()
+        # Returns the unprocessed lines from the current position up to and including the
+        # end of the current { } block without moving the current position
+        index = self._index
+        startline = self.current_line
         self.skip_current_section()
-        end = f.tell()
-        f.seek(curr)
-
-        rest = f.read(end-curr)
-
-        f.seek(curr)
-        return rest
-
-    def skip_next_section(self):
-        token = self.read_token()
-        if token == "{":
-            level = 1
+        rest = self._text.split("\n")[startline:self.current_line]
 
-            while level != 0:
-                token = self.read_token()
+        self._index = index
+        return "\n".join(rest) + "\n"
 
+    def read_section_rest(self):
+        # Reads up to the end of the current { } block and returns the tokens in it, without the closing }
+        tokens = self._tokens
+        start = self._index
+        index = start
+        level = 0
+        try:
+            while True:
+                token = tokens[index]
+                index += 1
                 if token == "{":
                     level += 1
                 elif token == "}":
+                    if level == 0:
+                        break
                     level -= 1
-                elif token == "":
-                    raise RuntimeError("Reached end of file while skipping {{ }} block. File is likely malformed")
+        except IndexError:
+            self._index = index
+            raise RuntimeError("Reached end of file while reading to end of current { } block. File is likely malformed.")
+
+        self._index = index
+        return tokens[start:index-1]
+
+    def read_parameter_sections(self):
+        # Reads a { } block made up of { "name" value ... } blocks and returns a list of the name
+        # and the tokens of each block
+        tokens = self._tokens
+        index = self._index
+        try:
+            if tokens[index] != "{":
+                raise RuntimeError("")
+            index += 1
+
+            sections = []
+            next = tokens[index]
+            while next != "}":
+                if next != "{":
+                    self._index = index + 1
+                    raise GenSyntaxError("Malformed file, expected {{ or }} but got {0}".format(next),
+                                         data={"line": self.current_line, "value": None})
+
+                name = tokens[index+1]
+                if len(name) < 2 or name[0] != "\"" or name[-1] != "\"":
+                    self._index = index + 2
+                    raise GenSyntaxError("Malformed String", data={"line": self.current_line, "value": name})
+
+                # Most parameters don't have nested blocks so the end of the block is the next }
+                start = index + 2
+                end = tokens.index("}", start)
+                if "{" in tokens[start:end]:
+                    self._index = start
+                    values = self.read_section_rest()
+                    end = self._index - 1
+                else:
+                    values = tokens[start:end]
+
+                sections.append((intern(name[1:-1]), values))
+                index = end + 1
+                next = tokens[index]
+        except (IndexError, ValueError):
+            self._index = len(tokens) + 1
+            raise GenSyntaxError("Reached end of file while parsing parameters",
+                                 data={"line": self.current_line, "value": None})
+
+        self._index = index + 1
+        return sections
+
+    def skip_next_section(self):
+        tokens = self._tokens
+        index = self._index
+        token = self.read_token()
+        if token == "{":
+            # Jump from } to } and count the { in between until the block is closed
+            level = 0
+            try:
+                while True:
+                    end = tokens.index("}", index)
+                    level += tokens[index:end].count("{") - 1
+                    index = end + 1
+                    if level <= 0:
+                        break
+            except ValueError:
+                self._index = len(tokens) + 1
+                raise RuntimeError("Reached end of file while skipping {{ }} block. File is likely malformed")
+            self._index = index
         else:
             raise RuntimeError("Expected '{{' for start of section, instead got {0}".format(token))
 
+    def skip_tokens(self, count):
+        self._index += count
+
+    def tell(self):
+        # Index of the next token
+        return self._index
+
+    def seek(self, index):
+        self._index = index
+
+    def get_line(self, index):
+        # Number of the line the token at index is on
+        if self._linenumbers is None:
+            self._linenumbers, self._linecount = self._get_line_numbers()
+        return self._linenumbers[index]
+
     def skip_current_section(self):
         level = 0
         while level != -1:
@@ -180,12 +296,7 @@ class GeneratorReader(object):
                 raise RuntimeError("Reached end of file while skipping to end of current { } block. File is likely malformed.")
 
     def read_vector3f(self):
-        val = self.read_token()
-        floats = val.split(" ")
-        if len(floats) != 3:
-            raise RuntimeError("Tried to read Vector3f but got {0}".format(floats))
-
-        return float(floats[0]), float(floats[1]), float(floats[2])
+        return parse_vector3f(self.read_token())
 
     def read_integer(self):
         val = self.read_token()
@@ -203,10 +314,9 @@ class GeneratorReader(object):
         val = self.read_token()
         #print(val)
 
-        #assert val[0] == "\"" and val[-1] == "\""
-        syntax_assert(val[0] == "\"" and val[-1] == "\"",
-                      "Malformed String", self.current_line, val)
-        return val[1:-1]
+        if len(val) < 2 or val[0] != "\"" or val[-1] != "\"":
+            raise GenSyntaxError("Malformed String", data={"line": self.current_line, "value": val})
+        return intern(val[1:-1])
 
     def read_string_tripple(self):
         val = self.read_token()
@@ -219,13 +329,13 @@ class GeneratorReader(object):
             if char == "\"" and start is None:
                 start = i
             elif char == "\"" and start is not None:
-                tripple.append(val[start:i+1])
+                tripple.append(intern(val[start:i+1]))
                 start = None
 
         if start is not None:
             raise RuntimeError("Malformed string tripple {0}".format(val))
 
-        return tripple
+        return tuple(tripple)
 
     def read_float_int(self):
         val = self.read_token()
@@ -238,8 +348,8 @@ class GeneratorReader(object):
         i, s = val.split(" ")
         s = s.strip()
 
-        syntax_assert(s[0] == "\"" and s[-1] == "\"",
-                      "Malformed String", self.current_line, val)
+        if s[0] != "\"" or s[-1] != "\"":
+            raise GenSyntaxError("Malformed String", data={"line": self.current_line, "value": val})
 
         return int(i), s[1:-1]
 
@@ -248,8 +358,34 @@ class GeneratorParameters(object):
     pass
 
 
+class ObjectVector3(Vector3):
+    # Position or rotation of a generator object. Changing it marks the object as changed so that it
+    # is written anew when the file is saved, no matter where it is changed. Reading it is as quick as
+    # reading a Vector3, only setting goes through __setattr__.
+    __slots__ = ("_owner",)
+
+    def __init__(self, x, y, z, owner=None):
+        object.__setattr__(self, "x", x)
+        object.__setattr__(self, "y", y)
+        object.__setattr__(self, "z", z)
+        object.__setattr__(self, "_owner", owner)
+
+    def __setattr__(self, name, value):
+        # When copying, the fields can be set before the owner is. Setting a field to the value it already
+        # has (e.g. the side panel being filled in) doesn't count as a change.
+        owner = getattr(self, "_owner", None)
+        if owner is not None and name != "_owner" and getattr(self, name, None) != value:
+            owner.dirty = True
+        object.__setattr__(self, name, value)
+
+
 class GeneratorObject(object):
-    def __init__(self, name, version, generatorid=["", "", ""], modes=["1", "1", "1"], fid="0", fmt="0"):
+    # Files can have thousands of objects so they don't get a __dict__
+    __slots__ = ("name", "version", "generatorid", "modes", "fid", "fmt",
+                 "spline", "spline_float", "spline_params",
+                 "position", "rotation", "scale", "unknown_params", "dirty", "_param_floats")
+
+    def __init__(self, name, version, generatorid=("", "", ""), modes=("1", "1", "1"), fid="0", fmt="0"):
         self.name = name
         self.version = version
         self.generatorid = generatorid
@@ -261,11 +397,16 @@ class GeneratorObject(object):
         self.spline_float = None
         self.spline_params = []
 
-        self.position = Vector3(0, 0, 0)
-        self.rotation = Vector3(0, 0, 0)
+        self.position = ObjectVector3(0, 0, 0, self)
+        self.rotation = ObjectVector3(0, 0, 0, self)
         self.scale = 1.0
 
-        self.unknown_params = OrderedDict()
+        self.unknown_params = {}  # Keeps the order the parameters are in like an OrderedDict but is a lot smaller
+        self._param_floats = None  # Parameters already turned into floats by get_param_float
+
+        # Set when the object is changed after it was read from a file so it has to be written anew
+        # instead of reusing the text it was read from
+        self.dirty = True
 
     def from_other(self, obj):
         self.name = obj.name
@@ -280,15 +421,78 @@ class GeneratorObject(object):
         self.spline_float = obj.spline_float
         self.spline_params = obj.spline_params
 
-        self.position = obj.position
-        self.rotation = obj.rotation
+        # The object keeps its own vectors, they can be part of an ObjectStore. Using the vectors of
+        # the other object would also mark that object as changed.
+        position = getattr(self, "position", None)
+        if position is None:
+            self.position = ObjectVector3(obj.position.x, obj.position.y, obj.position.z, self)
+        else:
+            position.x, position.y, position.z = obj.position.x, obj.position.y, obj.position.z
+        rotation = getattr(self, "rotation", None)
+        if rotation is None:
+            self.rotation = ObjectVector3(obj.rotation.x, obj.rotation.y, obj.rotation.z, self)
+        else:
+            rotation.x, rotation.y, rotation.z = obj.rotation.x, obj.rotation.y, obj.rotation.z
         self.scale = obj.scale
 
         self.unknown_params = obj.unknown_params
+        self._param_floats = None
+        self.dirty = True
 
     def copy(self):
         return deepcopy(self)
 
+    def get_param_float(self, param):
+        # First value of the parameter as a float, or None if the object doesn't have the parameter or
+        # it isn't a number. The strings in unknown_params stay what is written to the file, the float is
+        # kept so that it doesn't have to be parsed again every time the object is drawn.
+        floats = self._param_floats
+        if floats is not None and param in floats:
+            return floats[param]
+
+        values = self.unknown_params.get(param)
+        if isinstance(values, float):
+            val = values
+        else:
+            try:
+                val = float(values[0])
+            except (TypeError, IndexError, ValueError):
+                val = None
+
+        # Reading unknown_params of a lazily loaded object loads it which clears the floats
+        if self._param_floats is None:
+            self._param_floats = {}
+        self._param_floats[param] = val
+        return val
+
+    def invalidate_params(self):
+        # Has to be called when unknown_params is changed in place
+        self._param_floats = None
+
+    def get_state(self):
+        # The fields of the object as plain tuples and lists which are a lot quicker to pickle
+        return (self.name, self.version, self.generatorid, self.modes, self.fid, self.fmt,
+                (self.position.x, self.position.y, self.position.z),
+                (self.rotation.x, self.rotation.y, self.rotation.z), self.scale,
+                list(self.unknown_params.items()),
+                self.spline, self.spline_float,
+                [(id, name, list(params.items())) for id, name, params in self.spline_params])
+
+    @classmethod
+    def from_state(cls, state):
+        (name, version, generatorid, modes, fid, fmt, position, rotation, scale, params,
+         spline, spline_float, spline_params) = state
+
+        obj = cls(name, version, generatorid, modes, fid, fmt)
+        obj.position = ObjectVector3(*position, obj)
+        obj.rotation = ObjectVector3(*rotation, obj)
+        obj.scale = scale
+        obj.unknown_params = dict(params)
+        obj.spline = spline
+        obj.spline_float = spline_float
+        obj.spline_params = [(id, name, OrderedDict(params)) for id, name, params in spline_params]
+        return obj
+
     @classmethod
     def from_generator_file(cls, reader: GeneratorReader):
 
@@ -298,11 +502,11 @@ class GeneratorObject(object):
         generatorid = reader.read_string_tripple()
         if int(version) >= 6:
             print("version 6 or higher, getting mode booleans")
-            modes = [
+            modes = (
                 reader.read_token(),
                 reader.read_token(),
                 reader.read_token()
-            ]
+            )
             if int(version) >= 7:
                 print("version 7 or higher, getting fid and fmt")
                 fid = reader.read_token()
@@ -408,54 +612,18 @@ class GeneratorObject(object):
         writer.close_bracket()
 
     def read_parameters(self, reader: GeneratorReader):
-        if reader.read_token() != "{":
-            raise RuntimeError("")
-
-        next = reader.read_token()
-        if next == "":
-            raise RuntimeError("Tried to read parameters but encountered EOF")
-
-        assert next in ("{", "}")
-
-        while next != "}":
-            param_name = reader.read_string()
+        self._param_floats = None
+        for param_name, values in reader.read_parameter_sections():
             if param_name == "mPos":
-                self.position = Vector3(*reader.read_vector3f())
-                reader.read_token()
+                self.position = ObjectVector3(*parse_vector3f(values[0]), self)
             elif param_name == "mPosture":
-                self.rotation = Vector3(*reader.read_vector3f())
-                reader.read_token()
+                self.rotation = ObjectVector3(*parse_vector3f(values[0]), self)
             elif param_name == "mBaseScale":
-                self.scale = reader.read_float()
-                reader.read_token()
+                self.scale = float(values[0])
             elif param_name == "mEmitRadius":
-                self.unknown_params[param_name] = reader.read_float()
-                reader.read_token()
+                self.unknown_params[param_name] = float(values[0])
             else:
-                unkdata = []
-                level = 0
-                while level != -1:
-                    subnext = reader.read_token()
-                    if subnext == "":
-                        raise RuntimeError("Encountered EOF while reading parameter")
-                    elif subnext == "{":
-                        level += 1
-                    elif subnext == "}":
-                        level -= 1
-
-                    if level != -1:
-                        unkdata.append(subnext)
-
-                self.unknown_params[param_name] = unkdata
-
-            next = reader.read_token()
-            syntax_assert(next != "",
-                          "Reached end of file while parsing parameters",
-                          reader.current_line)
-            syntax_assert(next in ("{", "}"),
-                          "Malformed file, expected {{ or }} but got {0}".format(next),
-                          reader.current_line)
-            #assert next in ("{", "}", "")
+                self.unknown_params[param_name] = values
 
     def _read_spline(self, reader: GeneratorReader):
         splinetext = reader.read_string()
@@ -491,12 +659,132 @@ class GeneratorObject(object):
                 self.spline_params.append((id, splinename, params))
 
 
+class LazyGeneratorObject(GeneratorObject):
+    # Generator object of which only the name and position are read when the file is loaded.
+    # The rest of the object is read from the file the first time any other field is accessed.
+    __slots__ = ("_reader", "_span")
+
+    def __init__(self, name, position, reader, start, end):
+        self.name = name
+        self.position = ObjectVector3(*position, self)
+        self.dirty = True
+        self._param_floats = None
+
+        self._reader = reader
+        self._span = (start, end)
+
+    def __getattr__(self, attr):
+        # Only called for fields that haven't been set, i.e. before the object is loaded
+        if attr.startswith("__") or attr in ("_reader", "_span") or self._reader is None:
+            raise AttributeError(attr)
+
+        self.load()
+        return getattr(self, attr)
+
+    def load(self):
+        reader = self._reader
+        if reader is None:
+            return
+
+        # The name and position might have been changed already so they are kept. The object counts as
+        # loaded while it is read so that from_other doesn't try to load the fields it sets.
+        name, dirty = self.name, self.dirty
+        position = self.position
+        x, y, z = position.x, position.y, position.z
+        self._reader = None
+        try:
+            reader.seek(self._span[0])
+            self.from_other(GeneratorObject.from_generator_file(reader))
+        except BaseException:
+            self._reader = reader
+            raise
+        position.x, position.y, position.z = x, y, z
+        self.name, self.dirty = name, dirty
+
+    def is_loaded(self):
+        return self._reader is None
+
+    def get_line_span(self):
+        # First and last line of the object in the file it was read from
+        reader = self._reader
+        if reader is None:
+            return None
+        return reader.get_line(self._span[0]), reader.get_line(self._span[1]-1)
+
+    def copy(self):
+        self.load()
+        return deepcopy(self)
+
+    @classmethod
+    def from_generator_file(cls, reader: GeneratorReader):
+        # Skips over the object, only reading the name and position
+        start = reader.tell()
+        name = reader.read_string()
+        version = reader.read_string()
+        reader.read_token()  # generator id
+        if int(version) >= 7:
+            reader.skip_tokens(5)  # modes, face id and face message table
+        elif int(version) >= 6:
+            reader.skip_tokens(3)  # modes
+
+        paramstart = reader.tell()
+        reader.skip_next_section()
+        try:
+            index = reader._tokens.index("\"mPos\"", paramstart, reader.tell())
+            position = parse_vector3f(reader._tokens[index+1])
+        except ValueError:
+            position = (0, 0, 0)
+
+        splinetext = reader.read_string()
+        if splinetext == "spline":
+            reader.skip_tokens(reader.read_integer())
+            spline_float, paramcount = reader.read_float_int()
+            for i in range(paramcount):
+                reader.read_token()  # id and name
+                reader.skip_next_section()
+
+        return cls(name, position, reader, start, reader.tell())
+
+
+def _read_segment(text, first, last):
+    # Reads the generator objects in a piece of a generator file, used for reading files in multiple processes.
+    # The first piece starts with the { of the file and the last one ends with the }.
+    # The objects are passed back as their state.
+    reader = GeneratorReader(StringIO(text))
+    if first and reader.read_token() != "{":
+        raise RuntimeError("Expected file to start with '{'")
+
+    states = []
+    next = reader.peek_token()
+    while next != "" and next != "}":
+        states.append(GeneratorObject.from_generator_file(reader).get_state())
+        next = reader.peek_token()
+
+    if (next == "}") != last:
+        raise RuntimeError("Malformed file, expected generator object or '}'")
+    return states
+
+
 class GeneratorFile(object):
     def __init__(self):
         self.generators = []
 
+        # Reader of the file the objects were read from and for each of those objects the tokens it spans,
+        # used to write objects that weren't changed the way they were in the file
+        self._source = None
+        self._spans = {}
+        self._chunks = None
+
+        # For files read in multiple processes the text and the objects that were read from it,
+        # the reader and spans are only made when they are needed
+        self._source_text = None
+        self._source_objects = None
+
     @classmethod
-    def from_file(cls, f):
+    def from_file(cls, f, lazy=False, workers=1):
+        # With lazy set only the names and positions of the objects are read, the rest of each object
+        # is read when it is first used. With more than one worker large files are cut into segments of
+        # whole objects that are read in separate processes.
         """data = f.read()
         if "#" not in data:
             #print(data)
@@ -505,9 +793,20 @@ class GeneratorFile(object):
         else:
             dontsave = False
         f.seek(0)"""
+        if workers > 1 and not lazy:
+            text = f.read()
+            if len(text) >= MIN_PARALLEL_SIZE:
+                genfile = cls._from_text_parallel(text, workers)
+                if genfile is not None:
+                    return genfile
+
+            # The file couldn't be read in parallel, read it here to get the error with the right line
+            f = StringIO(text)
+
         genfile = cls()
         reader = GeneratorReader(f)
         written = {}
+        objectcls = LazyGeneratorObject if lazy else GeneratorObject
 
         try:
             start = reader.read_token()
@@ -519,10 +818,10 @@ class GeneratorFile(object):
                 raise RuntimeError("Malformed file, expected generator object or '}'")
 
             while next != "}":
-                start = reader.f.tell()
-
-                generator = GeneratorObject.from_generator_file(reader)
-                end = reader.f.tell()
+                start = reader.tell()
+                generator = objectcls.from_generator_file(reader)
+                generator.dirty = False
+                genfile._spans[generator] = (start, reader.tell())
                 #print(generator.name)
                 genfile.generators.append(generator)
                 next = reader.peek_token()
@@ -551,18 +850,139 @@ class GeneratorFile(object):
 
                 # reader.f.seek(end)
             f.seek(curr)"""
+            genfile._source = reader
             return genfile
 
         except Exception as e:
             print("Last line:", reader.current_line)
             raise
 
+    @classmethod
+    def _from_text_parallel(cls, text, workers):
+        # Cuts the text into one piece per worker after objects without a spline and reads each piece
+        # in a separate process. Returns None if the text couldn't be cut or a piece couldn't be read.
+        cuts = [0]
+        for i in range(1, workers):
+            match = NO_SPLINE.search(text, max(cuts[-1], len(text)*i//workers))
+            if match is None:
+                break
+            cuts.append(match.end())
+        if len(cuts) == 1:
+            return None
+        cuts.append(len(text))
+
+        genfile = cls()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = [executor.submit(_read_segment, text[start:end], start == 0, end == len(text))
+                       for start, end in zip(cuts, cuts[1:])]
+
+            # Turning the states back into objects makes a lot of containers which would make the
+            # garbage collector run over and over for nothing
+            gcenabled = gc.isenabled()
+            gc.disable()
+            try:
+                for result in results:
+                    genfile.generators.extend(GeneratorObject.from_state(state) for state in result.result())
+            except Exception:
+                return None
+            finally:
+                if gcenabled:
+                    gc.enable()
+
+        for obj in genfile.generators:
+            obj.dirty = False
+        genfile._source_text = text
+        genfile._source_objects = list(genfile.generators)
+        return genfile
+
+    def _read_source(self):
+        # Finds the tokens each object spans in the text of a file that was read in multiple processes
+        reader = GeneratorReader(StringIO(self._source_text))
+        reader.read_token()
+        for obj in self._source_objects:
+            start = reader.tell()
+            LazyGeneratorObject.from_generator_file(reader)
+            self._spans[obj] = (start, reader.tell())
+
+        self._source = reader
+        self._source_text = None
+        self._source_objects = None
+
+    def discard_source(self):
+        # Forgets the text the file was read from to free its memory, the whole file is then written anew when saving
+        self._source = None
+        self._spans = {}
+        self._chunks = None
+        self._source_text = None
+        self._source_objects = None
+
     def write(self, writer: GeneratorWriter):
+        if self._source_text is not None:
+            self._read_source()
+
+        if self._source is not None and writer.indent == 0:
+            writer.f.write(self.get_text())
+            return
+
         writer.open_bracket()
         for genobj in self.generators:
             genobj.write(writer)
         writer.close_bracket()
 
+    def _split_source(self):
+        # Cuts the source text into the part up to the first object, the part after the last one and
+        # for every object the comments and blank lines in front of it and the text of the object itself
+        reader = self._source
+        lines = reader._text.split("\n")
+
+        chunks = {}
+        start = reader.get_line(0)
+        for obj, span in sorted(self._spans.items(), key=lambda x: x[1][0]):
+            objstart = reader.get_line(span[0]) - 1
+            end = reader.get_line(span[1]-1)
+            gap = "\n".join(lines[start:objstart]) + "\n" if start < objstart else ""
+            chunks[obj] = (gap, "\n".join(lines[objstart:end]) + "\n")
+            start = end
+
+        head = "\n".join(lines[:reader.get_line(0)]) + "\n"
+        tail = "\n".join(lines[start:])
+        return head, chunks, tail
+
+    def get_text(self):
+        # Text of the whole file. Objects that weren't changed since they were read are copied from the
+        # file they were read from together with the comments and blank lines in front of them,
+        # only changed and new objects are written out.
+        if self._source_text is not None:
+            self._read_source()
+
+        if self._source is None:
+            tmp = StringIO()
+            self.write(GeneratorWriter(tmp))
+            return tmp.getvalue()
+
+        if self._chunks is None:
+            self._chunks = self._split_source()
+        head, chunks, tail = self._chunks
+
+        parts = [head]
+        for genobj in self.generators:
+            chunk = chunks.get(genobj)
+            if chunk is not None and not genobj.dirty:
+                parts.append(chunk[0])
+                parts.append(chunk[1])
+            else:
+                if chunk is not None:
+                    parts.append(chunk[0])
+
+                tmp = StringIO()
+                writer = GeneratorWriter(tmp)
+                writer.indent = 1
+                genobj.write(writer)
+                parts.append(tmp.getvalue())
+        parts.append(tail)
+
+        return "".join(parts)
+
 
 if __name__ == "__main__":
     with open("p29.txt", "r", encoding="shift-jis", errors="replace") as f:
@@ -0,0 +1,110 @@
+import os
+import sys
+import gc
+import tracemalloc
+from io import StringIO
+from collections import OrderedDict
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+from lib.libgen import GeneratorFile
+
+# Reports how much memory the objects of generator files take up once they are loaded, with the current
+# __slots__ layout and with the layout from before it: objects and vectors with a __dict__, an OrderedDict of
+# parameters, lists for the generator id and modes and a string object for every string that was read.
+# Only the objects are counted, not the text of the files that is kept for saving.
+# Usage: memory_benchmark.py file.txt [file.txt ...]
+
+
+class DictVector3(object):
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+
+class DictGeneratorObject(object):
+    pass
+
+
+def copy_string(string):
+    # Strings that were read weren't interned, so every one of them was its own object
+    return string[:1] + string[1:]
+
+
+def copy_float(val):
+    return val + 0.0
+
+
+def copy_vector(vec):
+    return DictVector3(copy_float(vec.x), copy_float(vec.y), copy_float(vec.z))
+
+
+def to_dict_layout(obj):
+    # Copy of a generator object in the layout from before __slots__
+    old = DictGeneratorObject()
+    old.name = copy_string(obj.name)
+    old.version = copy_string(obj.version)
+    old.generatorid = [copy_string(string) for string in obj.generatorid]
+    old.modes = [copy_string(mode) for mode in obj.modes]
+    old.fid = copy_string(obj.fid)
+    old.fmt = copy_string(obj.fmt)
+
+    old.spline = [tuple(copy_float(val) for val in point) for point in obj.spline]
+    old.spline_float = obj.spline_float
+    old.spline_params = [(id, copy_string(name), OrderedDict((copy_string(key), copy_string(val))
+                                                           for key, val in params.items()))
+                         for id, name, params in obj.spline_params]
+
+    old.position = copy_vector(obj.position)
+    old.rotation = copy_vector(obj.rotation)
+    old.scale = copy_float(obj.scale)
+
+    old.unknown_params = OrderedDict()
+    for param, values in obj.unknown_params.items():
+        if isinstance(values, float):
+            old.unknown_params[copy_string(param)] = copy_float(values)
+        else:
+            old.unknown_params[copy_string(param)] = [copy_string(val) for val in values]
+
+    return old
+
+
+def measure(function):
+    # Memory that is still in use after function ran, and the result of function
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    gc.collect()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, peak, result
+
+
+def load(texts):
+    genfiles = []
+    for text in texts:
+        genfile = GeneratorFile.from_file(StringIO(text))
+        genfile.discard_source()
+        genfiles.append(genfile)
+    return genfiles
+
+
+if __name__ == "__main__":
+    texts = []
+    for path in sys.argv[1:]:
+        with open(path, "r", encoding="shift-jis-2004", errors="replace") as f:
+            texts.append(f.read())
+
+    stdout = sys.stdout
+    sys.stdout = StringIO()  # Reading objects prints a lot
+    size, peak, genfiles = measure(lambda: load(texts))
+    sys.stdout = stdout
+
+    objects = [obj for genfile in genfiles for obj in genfile.generators]
+    count = len(objects)
+    oldsize, oldpeak, oldobjects = measure(lambda: [to_dict_layout(obj) for obj in objects])
+
+    print("{0} objects in {1} files".format(count, len(genfiles)))
+    print("Before (__dict__): {0} bytes in total, {1:.1f} bytes per object".format(oldsize, oldsize/count))
+    print("After (__slots__): {0} bytes in total, {1:.1f} bytes per object".format(size, size/count))
+    print("Peak while loading: {0} bytes".format(peak))
@@ -128,9 +128,11 @@ class ObjectModels(object):
         glPopMatrix()
 
     def draw_waterbox(self, position, rotation, scalex, scaley, scalez, selected):
+        # position is the (x, y, z) row of the object in its ObjectStore
         glPushMatrix()
 
-        glTranslatef(position.x, -position.z, position.y)
+        x, y, z = position
+        glTranslatef(x, -z, y)
         glRotate(rotation, 0, 0, 1)
         glScalef(scalex, scaley, scalez)
 
@@ -142,22 +144,26 @@ class ObjectModels(object):
         self.solid_cube.render()
         glPopMatrix()
 
-    def render_object(self, pikminobject, selected):
+    def render_object(self, pikminobject, position, rotation, selected):
+        # position and rotation are the (x, y, z) rows of the object in its ObjectStore,
+        # read for all objects at once instead of through the vectors of each object
         glPushMatrix()
 
-        glTranslatef(pikminobject.position.x, -pikminobject.position.z, pikminobject.position.y)
+        x, y, z = position
+        glTranslatef(x, -z, y)
 
-        if "mEmitRadius" in pikminobject.unknown_params and pikminobject.unknown_params["mEmitRadius"] > 0:
-            self.draw_cylinder_last_position(pikminobject.unknown_params["mEmitRadius"]/2, 50.0)
+        emit_radius = pikminobject.get_param_float("mEmitRadius")
+        if emit_radius is not None and emit_radius > 0:
+            self.draw_cylinder_last_position(emit_radius/2, 50.0)
 
-        if "mRadius" in pikminobject.unknown_params:
-            if len(pikminobject.unknown_params["mRadius"]) >= 1 and float(pikminobject.unknown_params["mRadius"][0]) > 0:
-                rad = float(pikminobject.unknown_params["mRadius"][0])
-                self.draw_cylinder_last_position(rad/2, 50.0)
+        rad = pikminobject.get_param_float("mRadius")
+        if rad is not None and rad > 0:
+            self.draw_cylinder_last_position(rad/2, 50.0)
 
-        glRotate(pikminobject.rotation.x, 1, 0, 0)
-        glRotate(pikminobject.rotation.y, 0, 0, 1)
-        glRotate(pikminobject.rotation.z, 0, 1, 0)
+        rotx, roty, rotz = rotation
+        glRotate(rotx, 1, 0, 0)
+        glRotate(roty, 0, 0, 1)
+        glRotate(rotz, 0, 1, 0)
 
         if pikminobject.name in self.models:
             self.models[pikminobject.name].render(selected=selected)
@@ -167,10 +173,11 @@ class ObjectModels(object):
 
         glPopMatrix()
 
-    def render_waypoint(self, waypoint, selected):
+    def render_waypoint(self, waypoint, position, selected):
         glPushMatrix()
 
-        glTranslatef(waypoint.position.x, -waypoint.position.z, waypoint.position.y)
+        x, y, z = position
+        glTranslatef(x, -z, y)
         if waypoint.waypoint_type in WAYPOINT_NODE_COLOR:
             color = WAYPOINT_NODE_COLOR[waypoint.waypoint_type]
         else:
@@ -179,21 +186,24 @@ class ObjectModels(object):
         self.generic_sphere.render(color, selected)
         glPopMatrix()
 
-    def render_waypoint_coloredid(self, waypoint, id):
+    def render_waypoint_coloredid(self, waypoint, position, id):
         glPushMatrix()
 
-        glTranslatef(waypoint.position.x, -waypoint.position.z, waypoint.position.y)
+        x, y, z = position
+        glTranslatef(x, -z, y)
 
         self.generic_sphere.render_coloredid(id)
         glPopMatrix()
 
-    def render_object_coloredid(self, pikminobject, id):
+    def render_object_coloredid(self, pikminobject, position, rotation, id):
         glPushMatrix()
 
-        glTranslatef(pikminobject.position.x, -pikminobject.position.z, pikminobject.position.y)
-        glRotate(pikminobject.rotation.x, 1, 0, 0)
-        glRotate(pikminobject.rotation.y, 0, 0, 1)
-        glRotate(pikminobject.rotation.z, 0, 1, 0)
+        x, y, z = position
+        rotx, roty, rotz = rotation
+        glTranslatef(x, -z, y)
+        glRotate(rotx, 1, 0, 0)
+        glRotate(roty, 0, 0, 1)
+        glRotate(rotz, 0, 1, 0)
 
         if pikminobject.name in self.models:
             self.models[pikminobject.name].render_coloredid(id)
@@ -0,0 +1,336 @@
+import os
+import sys
+import numpy
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+from lib.vectors import Vector3
+from lib.libgen import ObjectVector3
+
+# Keeps the positions and rotations of many objects in two numpy arrays with one row per object.
+# The renderer and picking read the rows of all objects in one go, operations on a selection (moving it,
+# grounding it, getting its average position) work on the rows of the selection at once.
+# The position and rotation of an object in the store are StoreVector3s that read and write the object's row,
+# so the rest of the code can keep using them like any other vector.
+
+
+class StoreVector3(Vector3):
+    # Like ObjectVector3, changing the vector marks the generator object it belongs to as changed.
+    # The row is read through a memoryview, indexing it gives Python floats which is quicker than numpy scalars.
+    __slots__ = ("_store", "_row", "_values", "_owner")
+
+    def __init__(self, store, row, values, owner=None):
+        self._store = store
+        self._row = row
+        self._values = values
+        self._owner = owner
+
+    def _set(self, i, val):
+        values = self._values
+        if values[i] != val:
+            values[i] = val
+            changed = self._store._changed
+            if changed is not None:
+                changed.add(self._row)
+            owner = self._owner
+            if owner is not None:
+                owner.dirty = True
+
+    @property
+    def x(self):
+        return self._values[0]
+
+    @x.setter
+    def x(self, val):
+        self._set(0, val)
+
+    @property
+    def y(self):
+        return self._values[1]
+
+    @y.setter
+    def y(self, val):
+        self._set(1, val)
+
+    @property
+    def z(self):
+        return self._values[2]
+
+    @z.setter
+    def z(self, val):
+        self._set(2, val)
+
+    def detach(self):
+        # Vector with the same values that isn't part of the store
+        if self._owner is not None:
+            return ObjectVector3(self.x, self.y, self.z, self._owner)
+        else:
+            return Vector3(self.x, self.y, self.z)
+
+    def __reduce__(self):
+        # Copies of the vector (e.g. of copied objects) aren't part of the store. When the object is copied
+        # with deepcopy, the owner of the copied vector is the copied object.
+        if self._owner is not None:
+            return ObjectVector3, (self.x, self.y, self.z, self._owner)
+        else:
+            return Vector3, (self.x, self.y, self.z)
+
+
+class ObjectStore(object):
+    # The rows are in the order of the list of objects the store was last synced with, so that the
+    # renderer can take the first rows as they are. The rows are also kept as lists for the renderer,
+    # only the rows that were changed since the last frame are turned into lists again.
+    def __init__(self, capacity=256):
+        self.positions = numpy.zeros((capacity, 3))
+        self.rotations = numpy.zeros((capacity, 3))
+
+        self._objects = []  # Objects in the order of their rows
+        self._rows = {}  # Row of each object
+        self._transforms = None  # Positions and rotations as lists
+        # Rows that changed since the lists were made, None if all of the lists have to be made again
+        self._changed = None
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __contains__(self, obj):
+        return obj in self._rows
+
+    def changed(self, rows=None):
+        # Has to be called after writing to the arrays directly, with the rows that were written to
+        # or without rows if it is unknown which rows changed
+        if rows is None:
+            self._changed = None
+        elif self._changed is not None:
+            self._changed.update(rows.tolist() if isinstance(rows, numpy.ndarray) else rows)
+
+    def _reserve(self, count):
+        capacity = len(self.positions)
+        if count <= capacity:
+            return
+
+        while capacity < count:
+            capacity *= 2
+        positions = numpy.zeros((capacity, 3))
+        rotations = numpy.zeros((capacity, 3))
+        positions[:len(self.positions)] = self.positions
+        rotations[:len(self.rotations)] = self.rotations
+        self.positions = positions
+        self.rotations = rotations
+
+        # The vectors still point at the old arrays
+        for row, obj in enumerate(self._objects):
+            self._attach(obj, row)
+
+    def _attach(self, obj, row):
+        # Points the vectors of the object at its row, vectors that aren't part of the store are replaced.
+        # The row has to hold the values of the object already.
+        position = obj.position
+        if type(position) is StoreVector3 and position._store is self:
+            position._row = row
+            position._values = memoryview(self.positions[row])
+        else:
+            owner = getattr(position, "_owner", None)
+            obj.position = StoreVector3(self, row, memoryview(self.positions[row]), owner)
+
+        rotation = getattr(obj, "rotation", None)
+        if rotation is None:
+            return
+        if type(rotation) is StoreVector3 and rotation._store is self:
+            rotation._row = row
+            rotation._values = memoryview(self.rotations[row])
+        else:
+            owner = getattr(rotation, "_owner", None)
+            obj.rotation = StoreVector3(self, row, memoryview(self.rotations[row]), owner)
+
+    def _detach(self, obj):
+        if type(obj.position) is StoreVector3:
+            obj.position = obj.position.detach()
+        rotation = getattr(obj, "rotation", None)
+        if type(rotation) is StoreVector3:
+            obj.rotation = rotation.detach()
+
+    def add(self, obj):
+        # Puts the object into the store after the other objects. Lazily loaded generator objects
+        # are loaded for their rotation. Returns the row of the object.
+        row = self._rows.get(obj)
+        if row is not None:
+            return row
+
+        row = len(self._objects)
+        self._reserve(row + 1)
+        position = obj.position
+        rotation = getattr(obj, "rotation", None)
+        self.positions[row] = (position.x, position.y, position.z)
+        if rotation is not None:
+            self.rotations[row] = (rotation.x, rotation.y, rotation.z)
+        else:
+            self.rotations[row] = 0.0
+        self._attach(obj, row)
+
+        self._objects.append(obj)
+        self._rows[obj] = row
+        self.changed()
+        return row
+
+    def remove(self, obj):
+        # The last object takes the row of the removed one
+        row = self._rows.pop(obj, None)
+        if row is None:
+            return
+
+        self._detach(obj)
+        last = self._objects.pop()
+        if last is not obj:
+            self.positions[row] = self.positions[len(self._objects)]
+            self.rotations[row] = self.rotations[len(self._objects)]
+            self._objects[row] = last
+            self._rows[last] = row
+            self._attach(last, row)
+        self.changed()
+
+    def clear(self):
+        self.sync([])
+
+    def sync(self, objects):
+        # Makes the store hold exactly the objects of the list in the same order, e.g. all generators of
+        # the loaded file. Objects that were added to the list are put into the store, objects that were
+        # removed from it are taken out. Nothing is done if the list didn't change.
+        if objects == self._objects:
+            return
+
+        keep = set(objects)
+        for obj in self._objects:
+            if obj not in keep:
+                self._detach(obj)
+
+        # The values are read through the vectors, the vectors of objects that are already in the store
+        # still read the old arrays until they are attached to their new row.
+        positions = []
+        rotations = []
+        for obj in objects:
+            position = obj.position
+            positions.append((position.x, position.y, position.z))
+            rotation = getattr(obj, "rotation", None)
+            if rotation is not None:
+                rotations.append((rotation.x, rotation.y, rotation.z))
+            else:
+                rotations.append((0.0, 0.0, 0.0))
+
+        capacity = len(self.positions)
+        while capacity < len(objects):
+            capacity *= 2
+        self.positions = numpy.zeros((capacity, 3))
+        self.rotations = numpy.zeros((capacity, 3))
+        if objects:
+            self.positions[:len(objects)] = positions
+            self.rotations[:len(objects)] = rotations
+
+        self._objects = list(objects)
+        self._rows = {}
+        for row, obj in enumerate(self._objects):
+            self._attach(obj, row)
+            self._rows[obj] = row
+        self.changed()
+
+    def get_transforms(self, objects):
+        # Positions and rotations of the objects as lists of [x, y, z] lists, read from the arrays in one go.
+        # The lists are kept for the next call so they must not be modified.
+        self.sync(objects)
+        count = len(self._objects)
+        changed = self._changed
+        if self._transforms is None or changed is None or len(changed) > count//8:
+            self._transforms = (self.positions[:count].tolist(), self.rotations[:count].tolist())
+        else:
+            positions, rotations = self._transforms
+            for row in changed:
+                positions[row] = self.positions[row].tolist()
+                rotations[row] = self.rotations[row].tolist()
+        self._changed = set()
+
+        return self._transforms
+
+
+def group_rows(objects):
+    # Sorts the objects by the store they are in. Returns the rows of the objects in each store together
+    # with the indices of those objects in the list, and the indices of the objects that aren't in a store.
+    try:
+        # Usually all of the objects are in the same store
+        store = objects[0].position._store
+        rowmap = store._rows
+        rows = [rowmap[obj] for obj in objects]
+        return [(store, numpy.array(rows, dtype=numpy.intp), numpy.arange(len(rows)))], []
+    except (IndexError, AttributeError, KeyError):
+        pass
+
+    stores = {}
+    rest = []
+    for i, obj in enumerate(objects):
+        position = obj.position
+        if type(position) is StoreVector3:
+            group = stores.get(position._store)
+            if group is None:
+                group = stores[position._store] = ([], [])
+            group[0].append(position._row)
+            group[1].append(i)
+        else:
+            rest.append(i)
+
+    return [(store, numpy.array(rows, dtype=numpy.intp), numpy.array(indices, dtype=numpy.intp))
+            for store, (rows, indices) in stores.items()], rest
+
+
+def _mark_changed(objects, indices):
+    # Changes to the arrays don't go through the vectors so the objects have to be marked here
+    for i in indices:
+        owner = objects[i].position._owner
+        if owner is not None:
+            owner.dirty = True
+
+
+def translate(objects, deltax, deltay, deltaz):
+    if deltax == 0 and deltay == 0 and deltaz == 0:
+        return
+
+    groups, rest = group_rows(objects)
+    delta = numpy.array((deltax, deltay, deltaz))
+    for store, rows, indices in groups:
+        store.positions[rows] += delta
+        store.changed(rows)
+        _mark_changed(objects, indices)
+
+    for i in rest:
+        position = objects[i].position
+        position.x += deltax
+        position.y += deltay
+        position.z += deltaz
+
+
+def get_average_position(objects):
+    groups, rest = group_rows(objects)
+    total = numpy.zeros(3)
+    for store, rows, indices in groups:
+        total += store.positions[rows].sum(axis=0)
+
+    for i in rest:
+        position = objects[i].position
+        total += (position.x, position.y, position.z)
+
+    total /= len(objects)
+    return float(total[0]), float(total[1]), float(total[2])
+
+
+def set_heights(objects, heights):
+    # Sets the y position of each object to the height in the same place, objects with a height
+    # of None aren't changed
+    heights = numpy.array([numpy.nan if height is None else height for height in heights])
+    groups, rest = group_rows(objects)
+    for store, rows, indices in groups:
+        values = heights[indices]
+        changed = ~numpy.isnan(values) & (store.positions[rows, 1] != values)
+        store.positions[rows[changed], 1] = values[changed]
+        store.changed(rows[changed])
+        _mark_changed(objects, indices[changed])
+
+    for i in rest:
+        if not numpy.isnan(heights[i]):
+            objects[i].position.y = float(heights[i])
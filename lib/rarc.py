@@ -1,8 +1,11 @@
-from struct import pack, unpack
+from struct import pack, unpack, unpack_from, iter_unpack
 from io import BytesIO
 from itertools import chain
-from .yaz0 import decompress, compress_fast, read_uint32, read_uint16
+from .yaz0 import (decompress_buffer, read_buffer, compress, Yaz0Writer,
+                   CompressionCache, DEFAULT_LEVEL)
+from .fileio import read_files, write_files, DEFAULT_IO_THREADS
 
+import os
 import time
 
 def write_uint32(f, val):
@@ -18,8 +21,6 @@ def write_pad32(f):
     #print(hex(f.tell()))
     #print(hex(next_aligned_pos))
 
-DATA = [0]
-
 # Hashing algorithm taken from Gamma and LordNed's WArchive-Tools, hope it works
 def hash_name(name):
     hash = 0
@@ -57,26 +58,11 @@ class StringTable(object):
     def write_to(self, f):
         f.write(self._strings.getvalue())
 
-def stringtable_get_name(f, stringtable_offset, offset):
-    current = f.tell()
-    f.seek(stringtable_offset+offset)
-
-    stringlen = 0
-    while f.read(1) != b"\x00":
-        stringlen += 1
-
-    f.seek(stringtable_offset+offset)
-
-    filename = f.read(stringlen)
-    try:
-        decodedfilename = filename.decode("shift-jis")
-    except:
-        print("filename", filename)
-        print("failed")
-        raise
-    f.seek(current)
-
-    return decodedfilename
+def buffer_get_name(strings, offset):
+    end = strings.find(b"\x00", offset)
+    if end == -1:
+        end = len(strings)
+    return strings[offset:end].decode("shift-jis")
 
 def split_path(path): # Splits path at first backslash encountered
     for i, char in enumerate(path):
@@ -98,88 +84,83 @@ class Directory(object):
         self.parent = None
 
     @classmethod
-    def from_dir(cls, path, follow_symlinks=False):
-        dirname = os.path.basename(path)
-        #print(dirname, path)
-        dir = cls(dirname)
+    def from_dir(cls, path, follow_symlinks=False, threads=DEFAULT_IO_THREADS):
+        # The directory tree is scanned first, then all files are read with a pool of threads.
+        # Files are added in the order they were found in so the result doesn't depend on the threads.
+        dir = cls(os.path.basename(path))
+        files = []
+        dir._scan_dir(path, follow_symlinks, files)
+
+        for (parent, name, filepath), data in zip(files, read_files([filepath for parent, name, filepath in files], threads)):
+            if data is not None:
+                file = File(name)
+                file.write(data)
+                file.seek(0)
+                parent.files[name] = file
 
+        return dir
+
+    def _scan_dir(self, path, follow_symlinks, files):
+        # Adds the subdirectories of the directory at path and collects (directory, name, path) of its files
         #with os.scandir(path) as entries: <- not supported in versions earlier than 3.6 apparently
         for entry in os.scandir(path):
-            #print(entry.path, dirname)
             if entry.is_dir(follow_symlinks=follow_symlinks):
-                newdir = Directory.from_dir(entry.path, follow_symlinks=follow_symlinks)
-                dir.subdirs[entry.name] = newdir
+                newdir = Directory(entry.name)
+                self.subdirs[entry.name] = newdir
+                newdir._scan_dir(entry.path, follow_symlinks, files)
 
             elif entry.is_file(follow_symlinks=follow_symlinks):
-                with open(entry.path, "rb") as f:
-                    file = File.from_file(entry.name, f)
-                dir.files[entry.name] = file
-
-        return dir
+                files.append((self, entry.name, entry.path))
 
 
 
     @classmethod
-    def from_node(cls, f, _name, stringtable_offset, globalentryoffset, dataoffset, nodelist, currentnodeindex, parents=None):
-        #print("=============================")
-        #print("Creating new node with index", currentnodeindex)
-        name, unknown, entrycount, entryoffset = nodelist[currentnodeindex]
-        if name is None:
-            name = _name 
-
-        newdir = cls(name, currentnodeindex)
-
-        firstentry = globalentryoffset+entryoffset
-        #print("Node", currentnodeindex, name, entrycount, entryoffset)
-        #print("offset", f.tell())
-        for i in range(entrycount):
-            offset = globalentryoffset + (entryoffset+i)*20
-            f.seek(offset)
+    def from_tables(cls, buffer, strings, nodes, entries, dataoffset, copy=False):
+        # Builds the directory tree from the node table and the file entry table, both already unpacked into
+        # lists of tuples. Files refer to slices of the buffer unless copy is True, then their data is copied
+        # into File objects.
+        nodetype, nameoffset, hashcode, entrycount, entryoffset = nodes[0]
+        root = cls(buffer_get_name(strings, nameoffset), 0)
 
-            fileentry_data = f.read(20)
+        # Directories whose entries still need to be read, with the node indices of their parent directories
+        pending = [(root, (0, ))]
 
-            fileid, hashcode, flags, padbyte, nameoffset, filedataoffset, datasize, padding = unpack(">HHBBHIII", fileentry_data)
-            #print("offset", hex(firstentry+i*20), fileid, flags, nameoffset)
+        while pending:
+            dir, parents = pending.pop()
+            nodetype, nameoffset, hashcode, entrycount, entryoffset = nodes[dir._nodeindex]
 
-            name = stringtable_get_name(f, stringtable_offset, nameoffset)
+            for fileid, hashcode, flags, padbyte, nameoffset, filedataoffset, datasize, padding in entries[entryoffset:entryoffset+entrycount]:
+                name = buffer_get_name(strings, nameoffset)
 
-            #print("name", name, fileid)
-
-            if name == "." or name == ".." or name == "":
-                continue
-            #print(name, nameoffset)
-
-            if (flags & 0b10) != 0 and not (flags & 0b1) == 1: #fileid == 0xFFFF: # entry is a sub directory
-                #fileentrydata = f.read(12)
-                #nodeindex, datasize, padding = unpack(">III", fileentrydata)
-                nodeindex = filedataoffset
-
-                name = stringtable_get_name(f, stringtable_offset, nameoffset)
-                #print(name, hashcode, hash_name(name))
-
-
-                newparents = [currentnodeindex]
-                if parents is not None:
-                    newparents.extend(parents)
-
-                if nodeindex in newparents:
-                    print("Detected recursive directory: ", name)
-                    print(newparents, nodeindex)
-                    print("Skipping")
+                if name == "." or name == ".." or name == "":
                     continue
 
-                subdir = Directory.from_node(f, name, stringtable_offset, globalentryoffset, dataoffset, nodelist, nodeindex, parents=newparents)
-                subdir.parent = newdir
-
-                newdir.subdirs[subdir.name] = subdir
-
-
-            else: # entry is a file
-                f.seek(offset)
-                file = File.from_fileentry(f, stringtable_offset, dataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize)
-                newdir.files[file.name] = file
-
-        return newdir
+                if (flags & 0b10) != 0 and not (flags & 0b1) == 1: # entry is a sub directory
+                    nodeindex = filedataoffset
+
+                    if nodeindex in parents:
+                        print("Detected recursive directory: ", name)
+                        print(parents, nodeindex)
+                        print("Skipping")
+                        continue
+
+                    subdir = cls(name, nodeindex)
+                    subdir.parent = dir
+                    dir.subdirs[subdir.name] = subdir
+                    pending.append((subdir, parents + (nodeindex, )))
+
+                else: # entry is a file
+                    start = dataoffset+filedataoffset
+                    view = buffer[start:start+datasize]
+                    if copy:
+                        file = File(name, fileid, hashcode, flags)
+                        file.write(view)
+                        file.seek(0)
+                    else:
+                        file = FileView(name, view, fileid, hashcode, flags)
+                    dir.files[file.name] = file
+
+        return root
 
     def walk(self, _path=None):
         if _path is None:
@@ -243,17 +224,24 @@ class Directory(object):
         entries.extend(dir.subdirs.keys())
         return entries
 
-    def extract_to(self, path):
-        current_dirpath = os.path.join(path, self.name)
-        os.makedirs(current_dirpath, exist_ok=True)
+    def extract_to(self, path, threads=DEFAULT_IO_THREADS):
+        # All directories are created first, then the files are written with a pool of threads
+        files = []
+        pending = [(self, path)]
+        while pending:
+            dir, parentpath = pending.pop()
+            current_dirpath = os.path.join(parentpath, dir.name)
+            os.makedirs(current_dirpath, exist_ok=True)
 
-        for filename, file in self.files.items():
-            filepath = os.path.join(current_dirpath, filename)
-            with open(filepath, "wb") as f:
-                file.dump(f)
+            for filename, file in dir.files.items():
+                files.append((os.path.join(current_dirpath, filename), file.getbuffer()))
 
-        for dirname, dir in self.subdirs.items():
-            dir.extract_to(current_dirpath)
+            for subdir in dir.subdirs.values():
+                pending.append((subdir, current_dirpath))
+
+        write_files(files, threads)
+        for filepath, view in files:
+            view.release()
 
 class File(BytesIO):
     def __init__(self, filename, fileid=None, hashcode=None, flags=None):
@@ -275,26 +263,51 @@ class File(BytesIO):
 
 
 
-    @classmethod
-    def from_fileentry(cls, f, stringtable_offset, globaldataoffset, fileid, hashcode, flags, nameoffset, filedataoffset, datasize):
-        filename = stringtable_get_name(f, stringtable_offset, nameoffset)
-        """print("-----")
-        print("File", len(filename))
-        print("size", datasize)
-        print(hex(stringtable_offset), hex(nameoffset))
-        print(hex(datasize))"""
-        file = cls(filename, fileid, hashcode, flags)
-
-        f.seek(globaldataoffset+filedataoffset)
-        file.write(f.read(datasize))
-        DATA[0] += datasize
-        # Reset file position
-        file.seek(0)
+    def dump(self, f):
+        f.write(self.getvalue())
 
-        return file
+
+class FileView(object):
+    # Read-only file object for a file in an archive buffer that doesn't copy the file's data
+    def __init__(self, filename, view, fileid=None, hashcode=None, flags=None):
+        self.name = filename
+        self._view = view
+        self._pos = 0
+        self._fileid = fileid
+        self._hashcode = hashcode
+        self._flags = flags
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(self._pos+size, len(self._view))
+        data = bytes(self._view[self._pos:end])
+        self._pos = max(self._pos, end)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        elif whence == 2:
+            self._pos = len(self._view) + offset
+        else:
+            raise ValueError("Invalid whence: {0}".format(whence))
+        if self._pos < 0:
+            raise ValueError("Negative seek position {0}".format(self._pos))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def getbuffer(self):
+        # A new view each time like BytesIO.getbuffer, so that releasing it doesn't affect this file
+        return memoryview(self._view)
+
+    def getvalue(self):
+        return bytes(self._view)
 
     def dump(self, f):
-        f.write(self.getvalue())
+        f.write(self._view)
 
 
 class Archive(object):
@@ -302,17 +315,18 @@ class Archive(object):
         self.root = None
 
     @classmethod
-    def from_dir(cls, path, follow_symlinks=False):
+    def from_dir(cls, path, follow_symlinks=False, threads=DEFAULT_IO_THREADS):
         arc = cls()
-        dir = Directory.from_dir(path, follow_symlinks=follow_symlinks)
+        dir = Directory.from_dir(path, follow_symlinks=follow_symlinks, threads=threads)
         arc.root = dir
 
         return arc
 
 
     @classmethod
-    def from_file(cls, f):
-        newarc = cls()
+    def from_file(cls, f, lazy=False, cache=None):
+        # With lazy=True the files of the archive refer to the archive data instead of being copied
+        # out of it, an uncompressed archive is memory-mapped.
         print("ok")
         header = f.read(4)
 
@@ -320,58 +334,53 @@ class Archive(object):
             # Decompress first
             print("Yaz0 header detected, decompressing...")
             start = time.time()
-            tmp = BytesIO()
-            f.seek(0)
-            decompress(f, tmp)
-            #with open("decompressed.bin", "wb") as g:
-            #    decompress(f,)
-            f = tmp
-            f.seek(0)
-
-            header = f.read(4)
+            # With a DecompressionCache, a file that was decompressed before is loaded from the cache instead
+            data = decompress_buffer(f, cache)
+
             print("Finished decompression.")
             print("Time taken:", time.time() - start)
-
-        if header == b"RARC":
-            pass
+        elif header == b"RARC":
+            if lazy:
+                data = read_buffer(f)
+            else:
+                f.seek(0)
+                data = f.read()
         else:
             raise RuntimeError("Unknown file header: {} should be Yaz0 or RARC".format(header))
 
-        size = read_uint32(f)
-        f.read(4) #unknown
+        return cls.from_buffer(data, copy=not lazy)
+
+    @classmethod
+    def from_buffer(cls, data, copy=False):
+        # Creates an archive from an uncompressed RARC in a buffer (bytes, memoryview or mmap).
+        # The node and file entry tables are unpacked in one go, the files of the archive are FileView
+        # objects that refer to the buffer so no file data is read until it is used, unless copy is True.
+        newarc = cls()
+        buffer = memoryview(data)
+
+        if bytes(buffer[0:4]) != b"RARC":
+            raise RuntimeError("Unknown file header: {} should be RARC".format(bytes(buffer[0:4])))
 
-        data_offset = read_uint32(f) + 0x20
-        f.read(16) # Unknown
-        node_count = read_uint32(f)
-        f.read(8) # Unknown
-        file_entry_offset = read_uint32(f) + 0x20
-        f.read(4) # Unknown
-        stringtable_offset = read_uint32(f) + 0x20
-        f.read(8) # Unknown
-        nodes = []
+        size, unknown, data_offset = unpack_from(">III", buffer, 0x4)
+        data_offset += 0x20
+        node_count = unpack_from(">I", buffer, 0x20)[0]
+        file_entry_offset = unpack_from(">I", buffer, 0x2C)[0] + 0x20
+        stringtable_size, stringtable_offset = unpack_from(">II", buffer, 0x30)
+        stringtable_offset += 0x20
+        strings = bytes(buffer[stringtable_offset:stringtable_offset+stringtable_size])
 
         print("Archive has", node_count, " total directories")
 
-                
-        
-        #print("data offset", hex(data_offset))
-        for i in range(node_count):
-            nodetype = f.read(4)
-            nodedata = f.read(4+2+2+4)
-            nameoffset, unknown, entrycount, entryoffset = unpack(">IHHI", nodedata)
-
-            if i == 0:
-                dir_name = stringtable_get_name(f, stringtable_offset, nameoffset)
-            else:
-                dir_name = None 
-                
-            nodes.append((dir_name, unknown, entrycount, entryoffset))
+        # Nodes are 16 bytes: type, name offset, name hash, entry count and index of the first entry
+        nodes = list(iter_unpack(">4sIHHI", buffer[0x40:0x40 + node_count*16]))
 
-        rootfoldername = nodes[0][0]
-        newarc.root = Directory.from_node(f, rootfoldername, stringtable_offset, file_entry_offset, data_offset, nodes, 0)
+        # Read as many file entries as the nodes refer to
+        entry_count = max(entryoffset + entrycount for nodetype, nameoffset, hashcode, entrycount, entryoffset in nodes)
+        entries = list(iter_unpack(">HHBBHIII", buffer[file_entry_offset:file_entry_offset + entry_count*20]))
 
-        return newarc
+        newarc.root = Directory.from_tables(buffer, strings, nodes, entries, data_offset, copy)
 
+        return newarc
 
     def listdir(self, path):
         if path == ".":
@@ -407,162 +416,163 @@ class Archive(object):
         else:
             self.root[rest] = entry
 
-    def extract_to(self, path):
-        self.root.extract_to(path)
+    def extract_to(self, path, threads=DEFAULT_IO_THREADS):
+        self.root.extract_to(path, threads)
+
+    def write_arc_compressed(self, f, level=DEFAULT_LEVEL, workers=1, cache=None):
+        layout = self.get_layout()
+        rarc_size = layout[-1]
 
-    def write_arc_compressed(self, f):
-        temp = BytesIO()
-        self.write_arc(temp)
-        temp.seek(0)
+        if cache is None and workers == 1:
+            # Stream the archive straight into the compressor
+            writer = Yaz0Writer(f, rarc_size, level)
+            self.write_layout(writer, layout)
+            writer.close()
+        else:
+            # The cache and the parallel compressor need all of the data at once
+            temp = BytesIO()
+            self.write_layout(temp, layout)
+            temp.seek(0)
 
-        compress_fast(temp, f)
+            compress(temp, f, level, workers, cache)
 
     def write_arc(self, f):
+        # The whole layout is worked out first so the archive can be written front to back
+        # in one pass, f doesn't need to be seekable.
+        self.write_layout(f, self.get_layout())
+
+    def get_layout(self):
+        # Returns the directories in node order with their subdirectory and file names, the views of the files
+        # with their data offsets, the string table, the offsets of the file entries, the string table and
+        # the file data, the total file entry count, the string table size and the total size of the archive.
         stringtable = StringTable()
-
-        nodes = BytesIO()
-        entries = BytesIO()
-        data = BytesIO()
-
-        nodecount = 1
-        entries = 0
-
-        # Set up string table with all directory and file names
         stringtable.write_string(".")
         stringtable.write_string("..")
         stringtable.write_string(self.root.name)
 
-        for dir, subdirnames, filenames in self.root.walk():
-            nodecount += len(subdirnames)
-            entries += len(subdirnames) + len(filenames)
-
-            for name in subdirnames:
-                stringtable.write_string(name)
-
-            for name in filenames:
-                stringtable.write_string(name)
-
-        f.write(b"RARC")
-        f.write(b"FOO ") # placeholder for filesize
-        write_uint32(f, 0x20)  #Unknown but often 0x20?
-        f.write(b"BAR ") # placeholder for data offset
-        f.write(b"\x00"*16) # 4 unknown ints
-
-        write_uint32(f, nodecount)
-        write_uint32(f, 0x20) # unknown
-        f.write(b"\x00"*4) # 1 unknown ints
-
-        #aligned_file_entry_offset = (0x20 + 44 + (nodecount*16) + 0x1F) & 0x20
-        #write_uint32(f, aligned_file_entry_offset)  # Offset to file entries aligned to multiples of 0x20
-        write_uint32(f, 0xF0F0F0F0)
-
-        f.write(b"\x00"*4) # 1 unknown int
-
-        #aligned_stringtable_offset = aligned_file_entry_offset + ((entries * 20) + 0x1F) & 0x20
-        #write_uint32(f, aligned_stringtable_offset)
-        write_uint32(f, 0xF0F0F0F0)
-
-        f.write(b"\x00"*8) # 2 unknown ints
-
-        node_offset = f.tell()
-
-        first_file_entry_index = 0
-
         dirlist = []
-
-        #aligned_data_offset = aligned_stringtable_offset + (stringtable.size() + 0x1F) & 0x20
+        files = []
+        total_file_entries = 0
+        datasize = 0
 
         for i, dirinfo in enumerate(self.root.walk()):
             dirpath, dirnames, filenames = dirinfo
             dir = self[dirpath]
             dir._nodeindex = i
+            dirlist.append((dir, dirnames, filenames))
 
-            dirlist.append(dir)
+            # Each directory has two special entries being the current and the parent directories
+            total_file_entries += len(dirnames) + len(filenames) + 2
 
-            if i == 0:
-                nodetype = b"ROOT"
-            else:
-                nodetype = dir.name.upper().encode("shift-jis")[:4]
-                if len(nodetype) < 4:
-                    nodetype = nodetype + (b"\x00"*(4 - len(nodetype)))
+            for name in dirnames:
+                stringtable.write_string(name)
+
+            for name in filenames:
+                stringtable.write_string(name)
 
-            f.write(nodetype)
-            write_uint32(f, stringtable.get_string_offset(dir.name))
-            hash = hash_name(dir.name)
+        for dir, dirnames, filenames in dirlist:
+            for filename, file in dir.files.items():
+                view = file.getbuffer()
+                files.append((filename, view, datasize))
+                datasize = (datasize + len(view) + 0x1F) & ~0x1F
+
+        file_entry_offset = (0x40 + len(dirlist)*16 + 0x1F) & ~0x1F
+        stringtable_offset = (file_entry_offset + total_file_entries*20 + 0x1F) & ~0x1F
+        stringtablesize = (stringtable.size() + 0x1F) & ~0x1F
+        data_offset = stringtable_offset + stringtablesize
+
+        return (dirlist, files, stringtable, file_entry_offset, stringtable_offset, data_offset,
+                total_file_entries, stringtablesize, data_offset + datasize)
+
+    def write_layout(self, f, layout):
+        (dirlist, files, stringtable, file_entry_offset, stringtable_offset, data_offset,
+         total_file_entries, stringtablesize, rarc_size) = layout
+
+        try:
+            f.write(b"RARC")
+            write_uint32(f, rarc_size)
+            write_uint32(f, 0x20)  #Unknown but often 0x20?
+            write_uint32(f, data_offset-0x20)
+            write_uint32(f, rarc_size - data_offset)
+            write_uint32(f, rarc_size - data_offset)
+            f.write(b"\x00"*8) # 2 unknown ints
+
+            write_uint32(f, len(dirlist))
+            write_uint32(f, 0x20) # unknown
+            write_uint32(f, total_file_entries)
+            write_uint32(f, file_entry_offset-0x20)
+            write_uint32(f, stringtablesize)
+            write_uint32(f, stringtable_offset-0x20)
+            f.write(b"\x00"*8) # 2 unknown ints
+
+            first_file_entry_index = 0
+
+            for i, (dir, dirnames, filenames) in enumerate(dirlist):
+                if i == 0:
+                    nodetype = b"ROOT"
+                else:
+                    nodetype = dir.name.upper().encode("shift-jis")[:4]
+                    if len(nodetype) < 4:
+                        nodetype = nodetype + (b"\x00"*(4 - len(nodetype)))
 
-            entrycount = len(dirnames) + len(filenames)
-            write_uint16(f, hash)
-            write_uint16(f, entrycount+2)
+                f.write(nodetype)
+                write_uint32(f, stringtable.get_string_offset(dir.name))
+                hash = hash_name(dir.name)
 
-            write_uint32(f, first_file_entry_index)
-            first_file_entry_index += entrycount + 2 # Each directory has two special entries being the current and the parent directories
+                entrycount = len(dirnames) + len(filenames)
+                write_uint16(f, hash)
+                write_uint16(f, entrycount+2)
 
-        write_pad32(f)
+                write_uint32(f, first_file_entry_index)
+                first_file_entry_index += entrycount + 2
 
-        current_file_entry_offset = f.tell()
-        #assert f.tell() == aligned_file_entry_offset
-        fileid = 0
+            f.write(b"\x00"*(file_entry_offset - 0x40 - len(dirlist)*16))
 
-        for dir in dirlist:
-            for filename, file in dir.files.items():
-                write_uint16(f, fileid)
-                write_uint16(f, hash_name(filename))
-                f.write(b"\x11\x00") # Flag for file+padding
-                write_uint16(f, stringtable.get_string_offset(filename))
-
-                filedata_offset = data.tell()
-                write_uint32(f, filedata_offset) # Write file data offset
-                data.write(file.getvalue()) # Write file data
-                write_uint32(f, data.tell()-filedata_offset) # Write file size
-                write_pad32(data)
-                write_uint32(f, 0)
-
-                fileid += 1
-
-            specialdirs = [(".", dir), ("..", dir.parent)]
-
-            for subdirname, subdir in chain(specialdirs, dir.subdirs.items()):
-                write_uint16(f, 0xFFFF)
-                write_uint16(f, hash_name(subdirname))
-                f.write(b"\x02\x00") # Flag for directory+padding
-                write_uint16(f, stringtable.get_string_offset(subdirname))
-
-                if subdir is None:
-                    child_nodeindex = 0xFFFFFFFF
-                else:
-                    child_nodeindex = subdir._nodeindex
-                write_uint32(f, child_nodeindex)
-                write_uint32(f, 0x10)
-                write_uint32(f, 0) # Padding
+            fileid = 0
+            fileinfo = iter(files)
 
-        write_pad32(f)
-        assert f.tell() % 0x20 == 0
-        current_stringtable_offset = f.tell()
-        stringtable.write_to(f)
+            for dir, dirnames, filenames in dirlist:
+                for filename in dir.files:
+                    filename, view, filedata_offset = next(fileinfo)
+                    write_uint16(f, fileid)
+                    write_uint16(f, hash_name(filename))
+                    f.write(b"\x11\x00") # Flag for file+padding
+                    write_uint16(f, stringtable.get_string_offset(filename))
 
-        write_pad32(f)
-        stringtablesize = f.tell() - current_stringtable_offset
+                    write_uint32(f, filedata_offset) # Write file data offset
+                    write_uint32(f, len(view)) # Write file size
+                    write_uint32(f, 0)
 
-        current_data_offset = f.tell()
+                    fileid += 1
 
-        f.write(data.getvalue())
+                specialdirs = [(".", dir), ("..", dir.parent)]
 
-        rarc_size = f.tell()
+                for subdirname, subdir in chain(specialdirs, dir.subdirs.items()):
+                    write_uint16(f, 0xFFFF)
+                    write_uint16(f, hash_name(subdirname))
+                    f.write(b"\x02\x00") # Flag for directory+padding
+                    write_uint16(f, stringtable.get_string_offset(subdirname))
 
-        f.seek(4)
-        write_uint32(f, rarc_size)
-        f.seek(12)
-        write_uint32(f, current_data_offset-0x20)
-        write_uint32(f, rarc_size - current_data_offset)
-        write_uint32(f, rarc_size - current_data_offset)
+                    if subdir is None:
+                        child_nodeindex = 0xFFFFFFFF
+                    else:
+                        child_nodeindex = subdir._nodeindex
+                    write_uint32(f, child_nodeindex)
+                    write_uint32(f, 0x10)
+                    write_uint32(f, 0) # Padding
 
-        f.seek(40)
+            f.write(b"\x00"*(stringtable_offset - file_entry_offset - total_file_entries*20))
+            stringtable.write_to(f)
+            f.write(b"\x00"*(stringtablesize - stringtable.size()))
 
-        total_file_entries = first_file_entry_index
-        write_uint32(f, total_file_entries)
-        write_uint32(f, current_file_entry_offset-0x20)
-        write_uint32(f, stringtablesize)
-        write_uint32(f, current_stringtable_offset-0x20)
+            # Each file is padded to a multiple of 0x20 bytes, including the last one
+            for filename, view, filedata_offset in files:
+                f.write(view)
+                f.write(b"\x00"*(-len(view) & 0x1F))
+        finally:
+            # Views that are still exported would keep the archive they come from from being closed
+            for filename, view, filedata_offset in files:
+                view.release()
 
 
 
@@ -587,11 +597,22 @@ if __name__ == "__main__":
     parser.add_argument("input",
                         help="Path to the archive file (usually .arc or .szs) to be extracted or the directory to be packed into an archive file.")
     parser.add_argument("--yaz0fast", action="store_true",
-                        help="Encode archive as yaz0 when doing directory->.arc/.szs")
+                        help="Encode archive as yaz0 with the fastest compression level when doing directory->.arc/.szs")
+    parser.add_argument("--yaz0", action="store_true",
+                        help="Encode archive as yaz0 with the level set by --level when doing directory->.arc/.szs")
+    parser.add_argument("--level", default=DEFAULT_LEVEL, type=int,
+                        help="Yaz0 compression level from 0 (no compression) to 9 (smallest output). Default is {0}".format(DEFAULT_LEVEL))
+    parser.add_argument("--cache", default=None,
+                        help="Directory of a cache for Yaz0 compressed data, repacking unchanged archives then skips compression")
+    parser.add_argument("--workers", default=os.cpu_count(), type=int,
+                        help="How many processes to use for Yaz0 compression. Default is the number of CPU cores")
     parser.add_argument("output", default=None, nargs = '?',
                         help="Output path to which the archive is extracted or a new archive file is written, depending on input.")
 
     args = parser.parse_args()
+    yaz0 = args.yaz0 or args.yaz0fast
+    level = 1 if args.yaz0fast else args.level
+    cache = CompressionCache(args.cache) if args.cache is not None else None
 
     inputpath = os.path.normpath(args.input)
     if os.path.isdir(inputpath):
@@ -604,7 +625,7 @@ if __name__ == "__main__":
         path, name = os.path.split(inputpath)
 
         if dir2arc:
-            if args.yaz0fast:
+            if yaz0:
                 ending = ".szs"
             else:
                 ending = ".arc"
@@ -637,8 +658,8 @@ if __name__ == "__main__":
         print("Directory loaded into memory, writing archive now")
 
         with open(outputpath, "wb") as f:
-            if args.yaz0fast:
-                archive.write_arc_compressed(f)
+            if yaz0:
+                archive.write_arc_compressed(f, level, args.workers, cache)
             else:
                 archive.write_arc(f)
         print("Done")
@@ -1,12 +1,22 @@
 from io import BytesIO
-from struct import pack, unpack
+from struct import pack, unpack, unpack_from, iter_unpack
 from collections import OrderedDict
+from collections.abc import MutableMapping
+from bisect import bisect_left
 import time
 import sys
 import os
+import hashlib
 sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
 
-from lib.yaz0 import decompress, compress_fast
+from lib.yaz0 import (decompress_buffer, read_buffer, iter_decompress, compress as yaz0_compress, Yaz0Writer,
+                      CompressionCache, DEFAULT_LEVEL)
+from lib.fileio import read_files, DEFAULT_IO_THREADS
+
+# Results of SARCArchive.patch_member
+PATCHED_IN_PLACE = "patched in place"
+REWRITTEN = "rewritten"
+
 
 def read_uint32(endian, f):
     return unpack(endian + "I", f.read(4))[0]
@@ -34,13 +44,18 @@ def stringtable_get_name(f, stringtable_offset, offset):
     current = f.tell()
     f.seek(stringtable_offset+offset)
 
-    stringlen = 0
-    while f.read(1) != b"\x00":
-        stringlen += 1
+    # Read the name in blocks instead of byte by byte until the terminating zero is found
+    filename = b""
+    while True:
+        block = f.read(0x40)
+        end = block.find(b"\x00")
+        if end != -1:
+            filename += block[:end]
+            break
+        elif not block:
+            break
+        filename += block
 
-    f.seek(stringtable_offset+offset)
-
-    filename = f.read(stringlen)
     try:
         decodedfilename = filename.decode("shift-jis")
     except:
@@ -52,6 +67,12 @@ def stringtable_get_name(f, stringtable_offset, offset):
     return decodedfilename
 
 
+def unpack_data_offset(header):
+    # Data offset field of a SARC header, the byte order mark tells us the endianness
+    endian = "<" if header[6:8] == b"\xFF\xFE" else ">"
+    return unpack(endian + "I", bytes(header[0xC:0x10]))[0]
+
+
 def calc_hash(name, key):
     result = 0
     for char in bytes(name, encoding="shift-jis"):
@@ -59,6 +80,90 @@ def calc_hash(name, key):
     return result
 
 
+def read_node_table(f):
+    # Reads the SARC header (without the magic), the SFAT nodes and their names from the SFNT table.
+    # Returns the endianness, the offset of the file data and a list of
+    # (path, attributes, data start, data end, hash) for each node.
+    endian = ">"
+    size_pos = f.tell()
+    f.read(2) # Discard while reading endianness
+    if read_uint16("<", f) == 0xFEFF:
+        endian = "<" # Little Endian
+
+    f.seek(size_pos)
+    header_size = read_uint16(endian, f)
+    assert read_uint16(endian, f) == 0xFEFF # Sanity check
+    size = read_uint32(endian, f)
+
+    data_offset = read_uint32(endian, f)
+    version = read_uint16(endian, f)
+    reserved = read_uint16(endian, f)
+
+    print("Archive version", hex(version), "reserved:", reserved)
+
+
+    # SFAT header
+    sfat = f.read(4)
+    assert sfat == b"SFAT"
+    sfat_header_size = read_uint16(endian, f)
+    assert sfat_header_size == 0xC
+    node_count = read_uint16(endian, f)
+    hash_key = read_uint32(endian, f)
+    assert hash_key == 0x65
+
+    nodes = []
+    for i in range(node_count):
+        filehash = read_uint32(endian, f)
+        fileattr = read_uint32(endian, f)
+        node_data_start = read_uint32(endian, f)
+        node_data_end = read_uint32(endian, f)
+        nodes.append((fileattr, node_data_start, node_data_end, filehash))
+
+    # String table
+    assert f.read(4) == b"SFNT"
+    assert read_uint16(endian, f) == 0x8
+    read_uint16(endian, f) # reserved
+
+    string_table_start = f.tell()
+
+    named_nodes = []
+    for fileattr, start, end, hash in nodes:
+        if fileattr & 0x01000000:
+            stringoffset = (fileattr & 0xFFFF) * 4
+            path = stringtable_get_name(f, string_table_start, stringoffset)
+        else:
+            path = None
+        named_nodes.append((path, fileattr, start, end, hash))
+
+    return endian, data_offset, named_nodes
+
+
+def check_layout(layout, padding=0x20):
+    # Checks that the data ranges of a layout from SARCArchive.get_layout are valid: every range starts aligned,
+    # lies within the archive and has the size of its file, and ranges are either the same or don't overlap.
+    # Files that share a range have to have the same data.
+    files, stringtable, dataoffset, totalsize = layout
+    shared = {}
+
+    for filepath, view, offset, endoffset in files:
+        if offset % padding != 0:
+            raise RuntimeError("Data of {0} at 0x{1:x} isn't aligned to 0x{2:x}".format(filepath, offset, padding))
+        if endoffset - offset != len(view) or dataoffset + endoffset > totalsize:
+            raise RuntimeError("Data range of {0} doesn't fit its data or the archive".format(filepath))
+
+        if (offset, endoffset) in shared:
+            otherpath, otherview = shared[(offset, endoffset)]
+            if view != otherview:
+                raise RuntimeError("{0} and {1} share data but aren't the same".format(filepath, otherpath))
+        else:
+            shared[(offset, endoffset)] = (filepath, view)
+
+    ranges = sorted(shared.keys())
+    for (start, end), (nextstart, nextend) in zip(ranges, ranges[1:]):
+        if nextstart < end:
+            raise RuntimeError("Data ranges 0x{0:x}-0x{1:x} and 0x{2:x}-0x{3:x} overlap".format(start, end, nextstart, nextend))
+
+
 class StringTable(object):
     def __init__(self):
         self._strings = BytesIO()
@@ -112,6 +217,137 @@ class File(BytesIO):
         return file
 
 
+class LazyFiles(MutableMapping):
+    # Dictionary of the files in an archive buffer that only creates File objects for files
+    # that are accessed. Names are decoded on demand, lookups by name go through the SFAT name hash.
+    def __init__(self, buffer, data_offset, strings, nodes):
+        self._buffer = buffer
+        self._data_offset = data_offset
+        self._strings = strings
+        self._nodes = nodes  # (hash, attributes, data start, data end) in SFAT order
+        self._names = [None]*len(nodes)
+        self._name_index = None
+
+        # The SFAT table should already be sorted by hash but archives written by other tools might not be
+        order = sorted(range(len(nodes)), key=lambda i: nodes[i][0])
+        self._sorted_hashes = [nodes[i][0] for i in order]
+        self._sorted_nodes = order
+
+        self._files = {}  # Files that have been accessed or added
+        self._removed = set()
+        self._added = []
+
+    def _name(self, i):
+        name = self._names[i]
+        if name is None:
+            attributes = self._nodes[i][1]
+            if not attributes & 0x01000000:
+                return None
+
+            start = (attributes & 0xFFFF) * 4
+            end = self._strings.find(b"\x00", start)
+            name = self._names[i] = self._strings[start:end].decode("shift-jis")
+
+        return name
+
+    def _find(self, path):
+        namehash = calc_hash(path, 0x65)
+        j = bisect_left(self._sorted_hashes, namehash)
+
+        while j < len(self._sorted_hashes) and self._sorted_hashes[j] == namehash:
+            i = self._sorted_nodes[j]
+            if self._name(i) == path:
+                return i
+            j += 1
+
+        # Archives written by other tools might not have the right hashes, so fall back to the names
+        if self._name_index is None:
+            self._name_index = {}
+            for i in range(len(self._nodes)):
+                name = self._name(i)
+                if name is not None:
+                    self._name_index[name] = i
+
+        return self._name_index.get(path)
+
+    def unnamed_nodes(self):
+        return [i for i in range(len(self._nodes)) if not self._nodes[i][1] & 0x01000000]
+
+    def node_view(self, i):
+        hash, attributes, start, end = self._nodes[i]
+        return self._buffer[self._data_offset+start:self._data_offset+end]
+
+    def node_file(self, i):
+        file = File(self._name(i), self._nodes[i][1])
+        file.write(self.node_view(i))
+        file.seek(0)
+        return file
+
+    def is_dirty(self, path):
+        # Files that have been accessed or added might have been changed and can't be copied from the buffer
+        return path in self._files
+
+    def get_view(self, path):
+        # Returns the data of a file as a memoryview without copying it
+        if self.is_dirty(path):
+            return self._files[path].getbuffer()
+        elif path in self._removed:
+            raise KeyError(path)
+
+        i = self._find(path)
+        if i is None:
+            raise KeyError(path)
+        return self.node_view(i)
+
+    def __getitem__(self, path):
+        if path in self._files:
+            return self._files[path]
+        elif path in self._removed:
+            raise KeyError(path)
+
+        i = self._find(path)
+        if i is None:
+            raise KeyError(path)
+
+        file = self._files[path] = self.node_file(i)
+        return file
+
+    def __contains__(self, path):
+        if path in self._files:
+            return True
+        elif path in self._removed:
+            return False
+        return self._find(path) is not None
+
+    def __setitem__(self, path, file):
+        # Files that are in the buffer keep their place even if they were removed before
+        if path not in self._files and path not in self._added and self._find(path) is None:
+            self._added.append(path)
+        self._removed.discard(path)
+        self._files[path] = file
+
+    def __delitem__(self, path):
+        if path not in self:
+            raise KeyError(path)
+
+        self._files.pop(path, None)
+        if path in self._added:
+            self._added.remove(path)
+        else:
+            self._removed.add(path)
+
+    def __iter__(self):
+        for i in range(len(self._nodes)):
+            name = self._name(i)
+            if name is not None and name not in self._removed:
+                yield name
+
+        yield from self._added
+
+    def __len__(self):
+        return sum(1 for path in self)
+
+
 class SARCArchive(object):
     def __init__(self):
         self.files = OrderedDict()
@@ -119,9 +355,12 @@ class SARCArchive(object):
         self.endian = ">"
 
     @classmethod
-    def from_folder(cls, folderpath):
+    def from_folder(cls, folderpath, threads=DEFAULT_IO_THREADS):
+        # The folder is walked first, then all files are read with a pool of threads.
+        # Files are added in the order they were found in so the result doesn't depend on the threads.
         arc = cls()
         skip = len(folderpath)
+        paths = []
 
         for dirpath, directories, files in os.walk(folderpath):
             print(dirpath)
@@ -133,80 +372,155 @@ class SARCArchive(object):
             print(relpath)
 
             for filename in files:
-                try:
-                    with open(os.path.join(dirpath, filename), "rb") as f:
-                        file = File.from_file(relpath+filename, f)
+                paths.append((relpath+filename, os.path.join(dirpath, filename)))
+
+        for (path, filepath), data in zip(paths, read_files([filepath for path, filepath in paths], threads)):
+            if data is not None:
+                file = File(path)
+                file.write(data)
+                file.seek(0)
+                arc.files[path] = file
 
-                    arc.files[relpath+filename] = file
-                except PermissionError:
-                    print("Permission denied:", os.path.join(dirpath, filename), "skipping...")
         return arc
 
-    def to_file(self, f, compress=False, padding=0x20):
-        if compress:
-            file = BytesIO()
+    def get_file_view(self, path):
+        # The data of a file as a memoryview. Files of a lazily loaded archive that haven't been
+        # accessed are returned straight from the archive's buffer.
+        if isinstance(self.files, LazyFiles):
+            return self.files.get_view(path)
         else:
-            file = f
+            return self.files[path].getbuffer()
 
-        endian = self.endian
-
-        file.write(b"SARC")
-        write_uint16(endian, file, 0x14) # size
-        write_uint16(endian, file, 0xFEFF) # byte order mark
-        archivesize_offset = file.tell()
-        file.write(b"ABCDEFGH") # fill in file size and data offset later
-        write_uint16(endian, file, 0x100)  # size
-        write_uint16(endian, file, 0)  # reserved
-
-        file.write(b"SFAT")
-        write_uint16(endian, file, 0xC)
-        write_uint16(endian, file, len(self.files))
-        write_uint32(endian, file, 0x00000065)
-
-        filedata = BytesIO()
-        stringtable = StringTable()
-        n = 0 
-        for filepath, _file in self.files.items():
-            write_pad(filedata, padding)
-            offset = filedata.tell()
-            filedata.write(_file.getvalue())
-            endoffset = filedata.tell()
-            
-            stringtable.write_string(filepath)
-            stringpos = stringtable.get_string_offset(filepath)
-            assert stringpos % 4 == 0
-            stringpos = stringpos//4
-            namehash = calc_hash(filepath, 0x65)
-
-            if stringpos > 0xFFFF:
-                raise RuntimeError("String table grew too big!")
-
-            write_uint32(endian, file, namehash)
-            write_uint32(endian, file, (0x0100 << 16) | stringpos)
-            write_uint32(endian, file, offset)
-            write_uint32(endian, file, endoffset)
-
-        file.write(b"SFNT")
-        write_uint16(endian, file, 0x8)
-        write_uint16(endian, file, 0x0)
-        stringtable.write_to(file)
-
-        write_pad(file, padding)
-        dataoffset = file.tell()
-        file.write(filedata.getvalue())
-        totalsize = file.tell()
-
-        file.seek(archivesize_offset)
-        write_uint32(endian, file, totalsize)
-        write_uint32(endian, file, dataoffset)
-
-        if compress:
+    def set_file_data(self, path, data):
+        file = File(path)
+        file.write(data)
+        file.seek(0)
+        self.files[path] = file
+
+    def to_file(self, f, compress=False, padding=0x20, level=DEFAULT_LEVEL, workers=1, cache=None, dedup=False):
+        # The whole layout is worked out first so the archive can be written front to back in one pass.
+        # f doesn't need to be seekable and when compressing, the archive goes straight into the compressor.
+        # With dedup=True, files with the same data share it in the archive.
+        layout = self.get_layout(padding, dedup)
+        totalsize = layout[-1]
+
+        if not compress:
+            self.write_layout(f, layout)
+        elif cache is None and workers == 1:
+            writer = Yaz0Writer(f, totalsize, level)
+            self.write_layout(writer, layout)
+            writer.close()
+        else:
+            # The cache and the parallel compressor need all of the data at once
+            file = BytesIO()
+            self.write_layout(file, layout)
             file.seek(0)
-            compress_fast(file, f)
+            yaz0_compress(file, f, level, workers, cache)
+
+    def get_layout(self, padding=0x20, dedup=False):
+        # Returns the views of the files with their data offsets, the string table,
+        # the offset of the file data and the total size of the archive.
+        # With dedup=True, a file with the same data as an earlier file gets the data range of that file.
+        files = []
+        filedata_size = 0
+        stringtable = StringTable()
+        ranges = {}
+        views = []
+
+        try:
+            for filepath in self.files:
+                view = self.get_file_view(filepath)
+                views.append(view)
+                stringtable.write_string(filepath)
+
+                if dedup:
+                    key = hashlib.sha1(view).digest()
+                    if key in ranges:
+                        offset, endoffset = ranges[key]
+                        files.append((filepath, view, offset, endoffset))
+                        continue
+
+                offset = (filedata_size + (padding-1)) & ~(padding-1)
+                filedata_size = offset + len(view)
+                files.append((filepath, view, offset, filedata_size))
+
+                if dedup:
+                    ranges[key] = (offset, filedata_size)
+
+            # SARC header, SFAT header and nodes, SFNT header and string table
+            headersize = 0x14 + 0xC + len(files)*16 + 0x8 + stringtable.size()
+            dataoffset = (headersize + (padding-1)) & ~(padding-1)
+
+            layout = files, stringtable, dataoffset, dataoffset + filedata_size
+            if dedup:
+                check_layout(layout, padding)
+        except BaseException:
+            # Views of the files that are left would keep them from being resized
+            for view in views:
+                view.release()
+            raise
+
+        return layout
+
+    def write_layout(self, file, layout):
+        files, stringtable, dataoffset, totalsize = layout
+        endian = self.endian
 
+        try:
+            file.write(b"SARC")
+            write_uint16(endian, file, 0x14) # size
+            write_uint16(endian, file, 0xFEFF) # byte order mark
+            write_uint32(endian, file, totalsize)
+            write_uint32(endian, file, dataoffset)
+            write_uint16(endian, file, 0x100)  # size
+            write_uint16(endian, file, 0)  # reserved
+
+            file.write(b"SFAT")
+            write_uint16(endian, file, 0xC)
+            write_uint16(endian, file, len(files))
+            write_uint32(endian, file, 0x00000065)
+
+            for filepath, view, offset, endoffset in files:
+                stringpos = stringtable.get_string_offset(filepath)
+                assert stringpos % 4 == 0
+                stringpos = stringpos//4
+                namehash = calc_hash(filepath, 0x65)
+
+                if stringpos > 0xFFFF:
+                    raise RuntimeError("String table grew too big!")
+
+                write_uint32(endian, file, namehash)
+                write_uint32(endian, file, (0x0100 << 16) | stringpos)
+                write_uint32(endian, file, offset)
+                write_uint32(endian, file, endoffset)
+
+            file.write(b"SFNT")
+            write_uint16(endian, file, 0x8)
+            write_uint16(endian, file, 0x0)
+            stringtable.write_to(file)
+
+            # Positions are counted here instead of using tell() so that file can be a pipe
+            position = 0x14 + 0xC + len(files)*16 + 0x8 + stringtable.size()
+            for filepath, view, offset, endoffset in files:
+                if dataoffset + offset < position:
+                    # Shares the data of a file that was already written
+                    continue
+
+                file.write(b"\x00"*(dataoffset + offset - position))
+                file.write(view)
+                position = dataoffset + endoffset
+
+            assert position == totalsize
+        finally:
+            # The views have to be released even if writing fails, otherwise the archive
+            # they come from can't be closed or resized
+            for filepath, view, offset, endoffset in files:
+                view.release()
 
     @classmethod
-    def from_file(cls, f):
+    def from_file(cls, f, lazy=False, use_mmap=True, cache=None):
+        # With lazy=True, only the files that are accessed are read from the archive. An uncompressed archive
+        # is memory-mapped unless use_mmap is False, which is needed if the same file is going to be overwritten.
         newarc = cls()
         print("ok")
         header = f.read(4)
@@ -215,72 +529,37 @@ class SARCArchive(object):
             # Decompress first
             print("Yaz0 header detected, decompressing...")
             start = time.time()
-            tmp = BytesIO()
-            f.seek(0)
-            decompress(f, tmp)
-            #with open("decompressed.bin", "wb") as g:
-            #    decompress(f,)
-            f = tmp
-            f.seek(0)
+            # With a DecompressionCache, a file that was decompressed before is loaded from the cache instead
+            data = decompress_buffer(f, cache)
 
-            header = f.read(4)
             print("Finished decompression.")
             print("Time taken:", time.time() - start)
 
+            if lazy:
+                return cls.from_buffer(data)
+
+            # The files are read straight from the decompressed data instead of copying all of it into a BytesIO
+            arc = cls.from_buffer(data)
+            newarc.endian = arc.endian
+            newarc.unnamed_files = arc.unnamed_files
+            for path in arc.files:
+                newarc.files[path] = arc.files[path]
+            return newarc
+        elif lazy:
+            if use_mmap:
+                return cls.from_buffer(read_buffer(f))
+            else:
+                f.seek(0)
+                return cls.from_buffer(f.read())
+
         if header == b"SARC":
             pass
         else:
             raise RuntimeError("Unknown file header: {} should be Yaz0 or SARC".format(header))
 
-        size_pos = f.tell()
-        f.read(2) # Discard while reading endianness
-        if read_uint16("<", f) == 0xFEFF:
-            newarc.endian = "<" # Little Endian
-        endian = newarc.endian
-
-        f.seek(size_pos)
-        header_size = read_uint16(endian, f)
-        assert read_uint16(endian, f) == 0xFEFF # Sanity check
-        size = read_uint32(endian, f)
-
-        data_offset = read_uint32(endian, f)
-        version = read_uint16(endian, f)
-        reserved = read_uint16(endian, f)
-
-        print("Archive version", hex(version), "reserved:", reserved)
-
-
-        # SFAT header
-        sfat = f.read(4)
-        assert sfat == b"SFAT"
-        sfat_header_size = read_uint16(endian, f)
-        assert sfat_header_size == 0xC
-        node_count = read_uint16(endian, f)
-        hash_key = read_uint32(endian, f)
-        assert hash_key == 0x65
-
-        nodes = []
-        for i in range(node_count):
-            filehash = read_uint32(endian, f)
-            fileattr = read_uint32(endian, f)
-            node_data_start = read_uint32(endian, f)
-            node_data_end = read_uint32(endian, f)
-            nodes.append((fileattr, node_data_start, node_data_end, filehash))
-
-        # String table
-        assert f.read(4) == b"SFNT"
-        assert read_uint16(endian, f) == 0x8
-        read_uint16(endian, f) # reserved
-
-        string_table_start = f.tell()
-
-        for fileattr, start, end, hash in nodes:
-            if fileattr & 0x01000000:
-                stringoffset = (fileattr & 0xFFFF) * 4
-                path = stringtable_get_name(f, string_table_start, stringoffset)
-            else:
-                path = None
+        newarc.endian, data_offset, nodes = read_node_table(f)
 
+        for path, fileattr, start, end, hash in nodes:
             file = File.from_node(path, fileattr, f, data_offset+start, data_offset+end)
             print(hash, calc_hash(path, 0x65))
             if path is not None:
@@ -291,6 +570,126 @@ class SARCArchive(object):
         print(len(newarc.unnamed_files))
         return newarc
 
+    @classmethod
+    def patch_member(cls, path, name, data, padding=0x20, level=DEFAULT_LEVEL, cache=None):
+        # Replaces the data of one file in the archive at path. For uncompressed archives the new data is
+        # written over the old data if it fits into the space the file has until the next file starts,
+        # otherwise the whole archive is rewritten. Returns PATCHED_IN_PLACE or REWRITTEN.
+        with open(path, "r+b") as f:
+            header = f.read(4)
+
+            if header == b"SARC":
+                endian, data_offset, nodes = read_node_table(f)
+                index = None
+                for i, node in enumerate(nodes):
+                    if node[0] == name:
+                        index = i
+                        break
+
+                if index is None:
+                    raise KeyError(name)
+
+                start, end = nodes[index][2], nodes[index][3]
+                slot_end = None  # None means this is the last file so it can grow freely
+                fits = True
+                for i, (otherpath, attr, otherstart, otherend, hash) in enumerate(nodes):
+                    if i == index:
+                        continue
+                    if otherstart < end and otherend > start:
+                        # Another node shares this data so it cannot be changed in place
+                        fits = False
+                    elif otherstart >= end and (slot_end is None or otherstart < slot_end):
+                        slot_end = otherstart
+
+                newend = start + len(data)
+                if fits and (slot_end is None or newend <= slot_end):
+                    f.seek(data_offset+start)
+                    f.write(data)
+                    if slot_end is not None and newend < end:
+                        f.write(b"\x00"*(end - newend))
+
+                    # SARC header is 0x14 bytes, then comes the SFAT header (0xC bytes) followed by the nodes.
+                    # The end offset is the last field of a node.
+                    f.seek(0x14 + 0xC + index*16 + 12)
+                    write_uint32(endian, f, newend)
+
+                    if slot_end is None:
+                        totalsize = data_offset + newend
+                        f.truncate(totalsize)
+                        f.seek(8)
+                        write_uint32(endian, f, totalsize)
+
+                    return PATCHED_IN_PLACE
+
+        with open(path, "rb") as f:
+            arc = cls.from_file(f, lazy=True, use_mmap=False)
+        arc.set_file_data(name, data)
+
+        with open(path, "wb") as f:
+            arc.to_file(f, compress=(header == b"Yaz0"), padding=padding, level=level, cache=cache)
+
+        return REWRITTEN
+
+    @classmethod
+    def from_buffer(cls, data):
+        # Creates an archive from an uncompressed SARC in a buffer (bytes, memoryview or mmap).
+        # Only the node table is read, File objects for the files are created when they are accessed.
+        newarc = cls()
+        buffer = memoryview(data)
+
+        if bytes(buffer[0:4]) != b"SARC":
+            raise RuntimeError("Unknown file header: {} should be SARC".format(bytes(buffer[0:4])))
+
+        if bytes(buffer[6:8]) == b"\xFF\xFE":
+            newarc.endian = "<"
+        endian = newarc.endian
+
+        header_size, bom, size, data_offset, version, reserved = unpack_from(endian+"HHIIHH", buffer, 4)
+        sfat, sfat_header_size, node_count, hash_key = unpack_from(endian+"4sHHI", buffer, header_size)
+        assert sfat == b"SFAT"
+        assert hash_key == 0x65
+
+        nodes_start = header_size + sfat_header_size
+        nodes_end = nodes_start + node_count*16
+        nodes = list(iter_unpack(endian+"IIII", buffer[nodes_start:nodes_end]))
+
+        assert bytes(buffer[nodes_end:nodes_end+4]) == b"SFNT"
+        sfnt_header_size = unpack_from(endian+"H", buffer, nodes_end+4)[0]
+        strings = bytes(buffer[nodes_end+sfnt_header_size:data_offset])
+
+        newarc.files = LazyFiles(buffer, data_offset, strings, nodes)
+        for i in newarc.files.unnamed_nodes():
+            newarc.unnamed_files.append(newarc.files.node_file(i))
+
+        return newarc
+
+    @staticmethod
+    def list_files(f):
+        # Returns the paths and sizes of the files in the archive. For Yaz0 compressed archives
+        # only the part up to the start of the file data is decompressed.
+        header = f.read(4)
+
+        if header == b"Yaz0":
+            f.seek(-4, 1)
+            stream = iter_decompress(f, 0x1000)
+            data = bytearray()
+            try:
+                for chunk in stream:
+                    data += chunk
+                    if len(data) >= 0x14 and len(data) >= unpack_data_offset(data):
+                        break
+            finally:
+                stream.close()
+
+            f = BytesIO(data)
+            header = f.read(4)
+
+        if header != b"SARC":
+            raise RuntimeError("Unknown file header: {} should be Yaz0 or SARC".format(header))
+
+        endian, data_offset, nodes = read_node_table(f)
+        return [(path, end-start) for path, fileattr, start, end, hash in nodes if path is not None]
+
 
 if __name__ == "__main__":
     """
@@ -319,13 +718,26 @@ if __name__ == "__main__":
     parser.add_argument("input",
                         help="Path to the archive file (usually .arc or .szs) to be extracted or the directory to be packed into an archive file.")
     parser.add_argument("--yaz0fast", action="store_true",
-                        help="Encode archive as yaz0 when doing directory->.arc/.szs")
+                        help="Encode archive as yaz0 with the fastest compression level when doing directory->.arc/.szs")
+    parser.add_argument("--yaz0", action="store_true",
+                        help="Encode archive as yaz0 with the level set by --level when doing directory->.arc/.szs")
+    parser.add_argument("--level", default=DEFAULT_LEVEL, type=int,
+                        help="Yaz0 compression level from 0 (no compression) to 9 (smallest output). Default is {0}".format(DEFAULT_LEVEL))
+    parser.add_argument("--cache", default=None,
+                        help="Directory of a cache for Yaz0 compressed data, repacking unchanged archives then skips compression")
+    parser.add_argument("--workers", default=os.cpu_count(), type=int,
+                        help="How many processes to use for Yaz0 compression. Default is the number of CPU cores")
     parser.add_argument("output", default=None, nargs='?',
                         help="Output path to which the archive is extracted or a new archive file is written, depending on input.")
     parser.add_argument("--padding", default=0x20, type=int,
                         help="How much padding there should be when writing file data. Default is 32 bytes")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Store the data of files that are exactly the same only once when doing directory->.arc/.szs")
 
     args = parser.parse_args()
+    yaz0 = args.yaz0 or args.yaz0fast
+    level = 1 if args.yaz0fast else args.level
+    cache = CompressionCache(args.cache) if args.cache is not None else None
 
     inputpath = os.path.normpath(args.input)
     if os.path.isdir(inputpath):
@@ -337,7 +749,7 @@ if __name__ == "__main__":
         path, name = os.path.split(inputpath)
 
         if dir2arc:
-            if args.yaz0fast:
+            if yaz0:
                 ending = ".szs"
             else:
                 ending = ".arc"
@@ -354,7 +766,8 @@ if __name__ == "__main__":
     if dir2arc:
         sarc = SARCArchive.from_folder(inputpath)
         with open(outputpath, "wb") as f:
-            sarc.to_file(f, padding=args.padding, compress=args.yaz0fast)
+            sarc.to_file(f, padding=args.padding, compress=yaz0, level=level, workers=args.workers, cache=cache,
+                         dedup=args.dedup)
     else:
         with open(inputpath, "rb") as f:
             sarc = SARCArchive.from_file(f)
@@ -0,0 +1,374 @@
+import os
+import sys
+import gc
+import mmap
+import struct
+import hashlib
+from io import StringIO
+from sys import intern
+import numpy
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+from lib.libgen import GeneratorFile, GeneratorObject
+from lib.libpath import Paths, Waypoint
+from lib.vectors import Vector3
+from lib.yaz0 import FileCache
+
+# Binary snapshots of parsed generator and path files, so that a file that was opened before can be
+# loaded again without parsing its text. A snapshot is made up of
+#   - a header,
+#   - a block of float64 rows with the position, rotation and scale of each object
+#     (position and radius for waypoints),
+#   - an int64 array with the structure of the objects and the string table indices of their strings,
+#   - a float64 array with the remaining floats (splines, emit radius, link distances),
+#   - the string table, all strings of the file encoded as utf-8 and separated by null characters.
+
+MAGIC = b"P3SNAP01"
+HEADER = struct.Struct("<8sIIQQQQQ")  # magic, kind, row width, rows, ints, floats, strings, string table size
+
+KIND_GENERATORS = 1
+KIND_PATHS = 2
+
+PARAM_TOKENS = 0
+PARAM_FLOAT = 1
+
+
+class _SnapshotWriter(object):
+    def __init__(self, kind, width):
+        self.kind = kind
+        self.width = width
+
+        self.rows = []
+        self.ints = []
+        self.floats = []
+        self.strings = {}
+
+    def add_string(self, string):
+        index = self.strings.get(string)
+        if index is None:
+            if "\0" in string:
+                raise RuntimeError("Can't put string containing a null character into snapshot: {0}".format(string))
+            index = self.strings[string] = len(self.strings)
+        self.ints.append(index)
+
+    def get_data(self):
+        strings = "\0".join(self.strings).encode("utf-8")
+        out = [HEADER.pack(MAGIC, self.kind, self.width, len(self.rows), len(self.ints), len(self.floats),
+                           len(self.strings), len(strings)),
+               numpy.array(self.rows, dtype="<f8").tobytes(),
+               numpy.array(self.ints, dtype="<i8").tobytes(),
+               numpy.array(self.floats, dtype="<f8").tobytes(),
+               strings]
+        return b"".join(out)
+
+
+def _read_snapshot(data, kind):
+    # Returns the rows, ints, floats and strings of the snapshot as lists, or None if the snapshot
+    # isn't of the right kind or is cut short.
+    if len(data) < HEADER.size:
+        return None
+    magic, datakind, width, rowcount, intcount, floatcount, stringcount, stringsize = HEADER.unpack_from(data)
+    if magic != MAGIC or datakind != kind:
+        return None
+
+    offset = HEADER.size
+    rowsize = rowcount*width*8
+    if len(data) != offset + rowsize + intcount*8 + floatcount*8 + stringsize:
+        return None
+
+    rows = numpy.frombuffer(data, "<f8", rowcount*width, offset).reshape((rowcount, width)).tolist()
+    offset += rowsize
+    ints = numpy.frombuffer(data, "<i8", intcount, offset).tolist()
+    offset += intcount*8
+    floats = numpy.frombuffer(data, "<f8", floatcount, offset).tolist()
+    offset += floatcount*8
+
+    if stringcount > 0:
+        strings = list(map(intern, data[offset:offset+stringsize].decode("utf-8").split("\0")))
+        if len(strings) != stringcount:
+            return None
+    else:
+        strings = []
+
+    return rows, ints, floats, strings
+
+
+def dump_generator_file(genfile):
+    snapshot = _SnapshotWriter(KIND_GENERATORS, 7)
+    add_string = snapshot.add_string
+    ints = snapshot.ints
+    floats = snapshot.floats
+
+    ints.append(len(genfile.generators))
+    for obj in genfile.generators:
+        (name, version, generatorid, modes, fid, fmt, position, rotation, scale, params,
+         spline, spline_float, spline_params) = obj.get_state()
+
+        snapshot.rows.append(position + rotation + (scale, ))
+        add_string(name)
+        add_string(version)
+        ints.append(len(generatorid))
+        for string in generatorid:
+            add_string(string)
+        ints.append(len(modes))
+        for mode in modes:
+            add_string(mode)
+        add_string(fid)
+        add_string(fmt)
+
+        ints.append(len(params))
+        for param, values in params:
+            add_string(param)
+            if isinstance(values, float):
+                ints.append(PARAM_FLOAT)
+                floats.append(values)
+            else:
+                ints.append(PARAM_TOKENS)
+                ints.append(len(values))
+                for value in values:
+                    add_string(value)
+
+        if spline_float is None:
+            ints.append(0)
+        else:
+            ints.append(1)
+            ints.append(len(spline))
+            for point in spline:
+                floats.extend(point)
+            floats.append(spline_float)
+
+            ints.append(len(spline_params))
+            for id, splinename, splineparams in spline_params:
+                ints.append(id)
+                add_string(splinename)
+                ints.append(len(splineparams))
+                for param, value in splineparams:
+                    add_string(param)
+                    add_string(value)
+
+    return snapshot.get_data()
+
+
+def load_generator_file(data, text=None):
+    # Returns the generator file in the snapshot or None if the snapshot can't be used. The text
+    # the snapshot was made from is used for saving the file the same way as one read from that text.
+    snapshot = _read_snapshot(data, KIND_GENERATORS)
+    if snapshot is None:
+        return None
+    rows, ints, floats, strings = snapshot
+
+    genfile = GeneratorFile()
+    i = 0
+    f = 0
+
+    # Like when reading a file in multiple processes, all the new containers would make
+    # the garbage collector run over and over for nothing
+    gcenabled = gc.isenabled()
+    gc.disable()
+    try:
+        count = ints[i]
+        i += 1
+        if count != len(rows):
+            return None
+        for row in rows:
+            name = strings[ints[i]]
+            version = strings[ints[i+1]]
+            n = ints[i+2]
+            i += 3
+            generatorid = tuple([strings[index] for index in ints[i:i+n]])
+            i += n
+            n = ints[i]
+            i += 1
+            modes = tuple([strings[index] for index in ints[i:i+n]])
+            i += n
+            fid = strings[ints[i]]
+            fmt = strings[ints[i+1]]
+            paramcount = ints[i+2]
+            i += 3
+
+            params = []
+            for j in range(paramcount):
+                param = strings[ints[i]]
+                if ints[i+1] == PARAM_FLOAT:
+                    params.append((param, floats[f]))
+                    f += 1
+                    i += 2
+                else:
+                    n = ints[i+2]
+                    i += 3
+                    params.append((param, [strings[index] for index in ints[i:i+n]]))
+                    i += n
+
+            spline = []
+            spline_float = None
+            spline_params = []
+            if ints[i] == 1:
+                n = ints[i+1]
+                i += 2
+                spline = [tuple(floats[f+j*3:f+j*3+3]) for j in range(n)]
+                f += n*3
+                spline_float = floats[f]
+                f += 1
+
+                n = ints[i]
+                i += 1
+                for j in range(n):
+                    id = ints[i]
+                    splinename = strings[ints[i+1]]
+                    paramcount = ints[i+2]
+                    i += 3
+                    splineparams = [(strings[ints[i+k*2]], strings[ints[i+k*2+1]]) for k in range(paramcount)]
+                    i += paramcount*2
+                    spline_params.append((id, splinename, splineparams))
+            else:
+                i += 1
+
+            obj = GeneratorObject.from_state(
+                (name, version, generatorid, modes, fid, fmt, row[0:3], row[3:6], row[6], params,
+                 spline, spline_float, spline_params))
+            obj.dirty = False
+            genfile.generators.append(obj)
+    except IndexError:
+        return None
+    finally:
+        if gcenabled:
+            gc.enable()
+
+    if i != len(ints) or f != len(floats):
+        return None
+
+    if text is not None:
+        genfile._source_text = text
+        genfile._source_objects = list(genfile.generators)
+    return genfile
+
+
+def dump_paths(paths):
+    snapshot = _SnapshotWriter(KIND_PATHS, 4)
+    ints = snapshot.ints
+    indices = {waypoint: i for i, waypoint in enumerate(paths.waypoints)}
+
+    ints.append(paths.version)
+    ints.append(len(paths.waypoints))
+    for waypoint in paths.waypoints:
+        position = waypoint.position
+        snapshot.rows.append((position.x, position.y, position.z, waypoint.radius))
+        snapshot.add_string(waypoint.id)
+        snapshot.add_string(waypoint.hints_id)
+        ints.append(waypoint.waypoint_type)
+
+        for links in (waypoint.outgoing_links, waypoint.incoming_links):
+            ints.append(len(links))
+            for other, (distance, val1, val2, val3, val4) in links.items():
+                snapshot.floats.append(distance)
+                ints.append(indices[other])
+                ints.append(val1)
+                ints.append(val2)
+                if val3 is None:
+                    ints.append(0)
+                else:
+                    ints.append(1)
+                    ints.append(val3)
+                    ints.append(val4)
+
+    return snapshot.get_data()
+
+
+def load_paths(data):
+    snapshot = _read_snapshot(data, KIND_PATHS)
+    if snapshot is None:
+        return None
+    rows, ints, floats, strings = snapshot
+
+    paths = Paths()
+    i = 0
+    f = 0
+    try:
+        paths.version = ints[0]
+        count = ints[1]
+        i += 2
+        waypoints = [Waypoint(j, "", "", Vector3(0.0, 0.0, 0.0), 100, paths.waypoints) for j in range(count)]
+
+        for waypoint, row in zip(waypoints, rows):
+            waypoint.position = Vector3(row[0], row[1], row[2])
+            waypoint.radius = row[3]
+            waypoint.id = strings[ints[i]]
+            waypoint.hints_id = strings[ints[i+1]]
+            waypoint.waypoint_type = ints[i+2]
+            i += 3
+
+            for links in (waypoint.outgoing_links, waypoint.incoming_links):
+                n = ints[i]
+                i += 1
+                for j in range(n):
+                    other, val1, val2 = waypoints[ints[i]], ints[i+1], ints[i+2]
+                    if ints[i+3] == 1:
+                        val3, val4 = ints[i+4], ints[i+5]
+                        i += 6
+                    else:
+                        val3 = val4 = None
+                        i += 4
+                    links[other] = [floats[f], val1, val2, val3, val4]
+                    f += 1
+
+            paths.waypoints.append(waypoint)
+    except IndexError:
+        return None
+
+    if i != len(ints) or f != len(floats) or len(paths.waypoints) != count:
+        return None
+
+    paths.regenerate_unique_paths()
+    return paths
+
+
+class SnapshotCache(FileCache):
+    # On-disk cache of snapshots of generator and path files, keyed by the hash of the text of the file.
+    # Entries are memory-mapped when they are loaded.
+    ending = ".snap"
+
+    def _entry_path(self, text, kind):
+        digest = hashlib.sha1(text.encode("utf-8", errors="surrogatepass")).hexdigest()
+        return os.path.join(self.path, "{0}_{1}.snap".format(digest, kind))
+
+    def get(self, text, kind):
+        # Returns a read-only mmap of the snapshot, or None if there is none for the text
+        entry_path = self._entry_path(text, kind)
+        try:
+            with open(entry_path, "rb") as f:
+                if os.fstat(f.fileno()).st_size < HEADER.size:
+                    return None
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+
+        return data
+
+    def put(self, text, kind, data):
+        self._write_entry(self._entry_path(text, kind), data)
+
+    def read_generator_file(self, text, workers=1):
+        # Files that have to be parsed are read with workers processes if they are large enough
+        data = self.get(text, KIND_GENERATORS)
+        if data is not None:
+            with data:
+                genfile = load_generator_file(data, text)
+            if genfile is not None:
+                return genfile
+
+        genfile = GeneratorFile.from_file(StringIO(text), workers=workers)
+        self.put(text, KIND_GENERATORS, dump_generator_file(genfile))
+        return genfile
+
+    def read_paths(self, text):
+        data = self.get(text, KIND_PATHS)
+        if data is not None:
+            with data:
+                paths = load_paths(data)
+            if paths is not None:
+                return paths
+
+        paths = Paths.from_file(StringIO(text))
+        self.put(text, KIND_PATHS, dump_paths(paths))
+        return paths
@@ -0,0 +1,73 @@
+import os
+import sys
+import mmap
+import tempfile
+from io import StringIO
+from timeit import default_timer
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+from lib.libgen import GeneratorFile, GeneratorWriter
+from lib.libpath import Paths
+from lib.snapshot import dump_generator_file, load_generator_file, dump_paths, load_paths
+
+# Compares how long it takes to parse generator and path files against loading their snapshots,
+# and checks that files loaded from a snapshot are written out the same as the parsed ones.
+# Usage: snapshot_benchmark.py [--paths] file.txt [file.txt ...]
+
+
+def best_time(func, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = default_timer()
+        result = func()
+        time = default_timer() - start
+        if best is None or time < best:
+            best = time
+    return best, result
+
+
+def get_text(obj):
+    tmp = StringIO()
+    if isinstance(obj, Paths):
+        obj.write(tmp)
+    else:
+        obj.write(GeneratorWriter(tmp))
+    return tmp.getvalue()
+
+
+if __name__ == "__main__":
+    paths = "--paths" in sys.argv
+    for path in sys.argv[1:]:
+        if path == "--paths":
+            continue
+
+        with open(path, "r", encoding="shift-jis-2004", errors="replace") as f:
+            text = f.read()
+
+        stdout = sys.stdout
+        sys.stdout = StringIO()  # Reading objects prints a lot
+        try:
+            if paths:
+                parsetime, parsed = best_time(lambda: Paths.from_file(StringIO(text)))
+                data = dump_paths(parsed)
+            else:
+                parsetime, parsed = best_time(lambda: GeneratorFile.from_file(StringIO(text)))
+                data = dump_generator_file(parsed)
+
+            with tempfile.TemporaryFile() as tmp:
+                tmp.write(data)
+                tmp.flush()
+                with mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    if paths:
+                        loadtime, loaded = best_time(lambda: load_paths(mapped))
+                    else:
+                        loadtime, loaded = best_time(lambda: load_generator_file(mapped, text))
+
+            same = get_text(loaded) == get_text(parsed)
+        finally:
+            sys.stdout = stdout
+
+        print(path)
+        print("Text: {0} bytes, parsed in {1:.3f}s".format(len(text.encode("utf-8")), parsetime))
+        print("Snapshot: {0} bytes, loaded in {1:.3f}s".format(len(data), loadtime))
+        print("Same output: {0}".format(same))
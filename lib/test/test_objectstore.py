@@ -0,0 +1,95 @@
+import os
+import sys
+import unittest
+from copy import deepcopy
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir))
+
+from lib.libgen import GeneratorObject, ObjectVector3
+from lib.libpath import Waypoint
+from lib.vectors import Vector3
+from lib.objectstore import ObjectStore, StoreVector3, translate, get_average_position, set_heights
+
+
+def make_objects(count):
+    objects = []
+    for i in range(count):
+        obj = GeneratorObject("Test", "1")
+        obj.position.x = float(i)
+        obj.rotation.y = float(i*2)
+        obj.dirty = False
+        objects.append(obj)
+    return objects
+
+
+class ObjectStoreTest(unittest.TestCase):
+    def test_sync(self):
+        objects = make_objects(300)
+        store = ObjectStore()
+        positions, rotations = store.get_transforms(objects)
+
+        self.assertEqual(len(store), 300)
+        self.assertEqual(positions[10], [10.0, 0.0, 0.0])
+        self.assertEqual(rotations[10], [0.0, 20.0, 0.0])
+        self.assertFalse(any(obj.dirty for obj in objects))
+
+        # Vectors keep working after the rows were moved around
+        vector = objects[20].position
+        removed = objects.pop(5)
+        objects.insert(0, GeneratorObject("Test", "1"))
+        store.sync(objects)
+        self.assertNotIn(removed, store)
+        self.assertIs(type(removed.position), ObjectVector3)
+        self.assertIs(removed.position._owner, removed)
+        self.assertIs(objects[20].position, vector)
+        vector.x = 123.0
+        self.assertEqual(store.get_transforms(objects)[0][20][0], 123.0)
+
+    def test_changes_mark_objects(self):
+        objects = make_objects(10)
+        store = ObjectStore()
+        store.sync(objects)
+
+        objects[0].position.x = objects[0].position.x
+        self.assertFalse(objects[0].dirty)
+        objects[0].rotation += Vector3(0.0, 1.0, 0.0)
+        self.assertTrue(objects[0].dirty)
+
+        translate(objects[1:3], 1.0, 2.0, 3.0)
+        self.assertEqual([obj.dirty for obj in objects[:4]], [True, True, True, False])
+        self.assertEqual((objects[1].position.x, objects[1].position.y, objects[1].position.z), (2.0, 2.0, 3.0))
+
+        set_heights(objects[3:6], [None, objects[4].position.y, 50.0])
+        self.assertEqual([obj.dirty for obj in objects[3:6]], [False, False, True])
+        self.assertEqual(objects[5].position.y, 50.0)
+
+    def test_average_position(self):
+        objects = make_objects(4)
+        waypoints = [Waypoint(i, "", "", Vector3(4.0, 8.0, 0.0), 100) for i in range(4)]
+        store = ObjectStore()
+        store.sync(objects)
+
+        # Objects in a store, waypoints that aren't in one
+        self.assertEqual(get_average_position(objects + waypoints), (2.75, 4.0, 0.0))
+
+    def test_copy_and_replace(self):
+        objects = make_objects(3)
+        store = ObjectStore()
+        store.sync(objects)
+
+        copy = deepcopy(objects[1])
+        self.assertIs(type(copy.position), ObjectVector3)
+        self.assertIs(copy.position._owner, copy)
+
+        copy.position.x = 9.0
+        vector = objects[2].position
+        objects[2].from_other(copy)
+        self.assertIs(objects[2].position, vector)
+        self.assertEqual(store.get_transforms(objects)[0][2][0], 9.0)
+
+        store.clear()
+        self.assertIs(type(objects[0].position), ObjectVector3)
+        self.assertNotIsInstance(objects[0].rotation, StoreVector3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir, os.path.pardir))
+
+from lib.rarc import Archive
+from lib.vfs import ArchiveFS
+
+
+class ArchiveFSTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        sourcedir = os.path.join(self.tmpdir, "root")
+        os.makedirs(os.path.join(sourcedir, "sub"))
+        with open(os.path.join(sourcedir, "sub", "a.txt"), "wb") as f:
+            f.write(b"hello")
+
+        self.arcpath = os.path.join(self.tmpdir, "test.arc").replace("\\", "/")
+        archive = Archive.from_dir(sourcedir)
+        with open(self.arcpath, "wb") as f:
+            archive.write_arc(f)
+
+        self.fs = ArchiveFS()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_rarc_member(self):
+        self.assertEqual(bytes(self.fs.read(self.arcpath + "/root/sub/a.txt")), b"hello")
+        self.assertTrue(self.fs.exists(self.arcpath + "/root/sub/a.txt"))
+
+    def test_missing_rarc_subdirectory(self):
+        path = self.arcpath + "/root/missing/a.txt"
+        self.assertFalse(self.fs.exists(path))
+        with self.assertRaises(FileNotFoundError):
+            self.fs.read(path)
+
+    def test_missing_rarc_file(self):
+        path = self.arcpath + "/root/sub/missing.txt"
+        self.assertFalse(self.fs.exists(path))
+        with self.assertRaises(FileNotFoundError):
+            self.fs.read(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,8 @@ from numpy import array
 
 
 class Vector3(object):
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, x, y, z):
         self.x = x
         self.y = y
@@ -82,6 +84,8 @@ class Vector3(object):
 
 
 class Vector4(Vector3):
+    __slots__ = ("w",)
+
     def __init__(self, x, y, z, w):
         Vector3.__init__(self, x, y, z)
         self.w = w
@@ -101,6 +105,8 @@ class Vector4(Vector3):
 
 
 class Vector2(Vector3):
+    __slots__ = ()
+
     def __init__(self, x, y):
         super().__init__(x, y, 0)
 
@@ -0,0 +1,230 @@
+import os
+import sys
+from io import BytesIO
+from collections import OrderedDict
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+
+from lib.yaz0 import decompress_data
+from lib.sarc import SARCArchive
+from lib.rarc import Archive, Directory
+
+# Read-only view of the files on disk where archives (Yaz0, SARC, RARC and any combination of them, e.g. archives
+# in archives) can be accessed like directories, e.g. "area/p29.szs/generator/p29.txt". Decoded archives are kept in
+# a least recently used cache up to a total size and are dropped when the file they came from is changed.
+# Files in archives are returned as views into the cached archive data so they aren't copied.
+
+DEFAULT_MAX_SIZE = 256*1024*1024
+
+
+def open_archive_data(data, cache=None):
+    # Detects the format of data by its magic. Returns the archive and the buffer it uses,
+    # or None and data if it is not an archive. Yaz0 compressed data is taken from cache (a DecompressionCache)
+    # if it was decompressed before.
+    if bytes(data[0:4]) == b"Yaz0":
+        if cache is not None:
+            data = cache.decompress_data(data)
+        else:
+            data = decompress_data(data)
+
+    magic = bytes(data[0:4])
+    if magic == b"SARC":
+        return SARCArchive.from_buffer(data), data
+    elif magic == b"RARC":
+        return Archive.from_buffer(data), data
+    else:
+        return None, data
+
+
+def get_member(archive, path):
+    # Returns a view of the data of the file at path in the archive, or None if there is no such file
+    if isinstance(archive, SARCArchive):
+        if path in archive.files:
+            return archive.get_file_view(path)
+        else:
+            return None
+    else:
+        try:
+            entry = archive[path]
+        except (FileNotFoundError, KeyError, RuntimeError):
+            # Directories that don't exist on the way to the file raise KeyError
+            return None
+
+        if isinstance(entry, Directory):
+            return None
+        else:
+            return entry.getbuffer()
+
+
+def list_members(archive):
+    if isinstance(archive, SARCArchive):
+        return list(archive.files)
+    else:
+        members = []
+        for dirpath, dirnames, filenames in archive.root.walk():
+            for filename in filenames:
+                members.append(dirpath + "/" + filename)
+        return members
+
+
+def split_path(path):
+    # Splits path into the part that exists on disk and the parts inside of it
+    parts = path.replace("\\", "/").split("/")
+    for i in range(1, len(parts)+1):
+        diskpath = "/".join(parts[:i])
+        if diskpath and os.path.isfile(diskpath):
+            return diskpath, parts[i:]
+
+    raise FileNotFoundError(path)
+
+
+class ArchiveFS(object):
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, cache=None):
+        self.max_size = max_size
+        self.cache = cache
+
+        # Maps the path of an archive to the size and modification time of the file on disk it comes from,
+        # the archive and the size of the archive data. Most recently used archives are at the end.
+        self._archives = OrderedDict()
+        self._size = 0
+        # Maps the path of an archive that is a view into the data of the archive it is in to the path of
+        # that archive. The outer archive is kept in the cache as long as the view is, its data can't be freed anyway.
+        self._views = {}
+
+    def _get_stamp(self, diskpath):
+        stat = os.stat(diskpath)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _load_archive(self, diskpath, parts, stamp):
+        # Returns the cached archive at diskpath/parts, decoding it (and the archives it is in) if needed.
+        # parts has to point at an archive.
+        key = "/".join([diskpath] + parts)
+        entry = self._archives.get(key)
+        if entry is not None:
+            if entry[0] == stamp:
+                self._archives.move_to_end(key)
+                return entry[1]
+            else:
+                self.invalidate(diskpath)
+
+        if parts:
+            parent = self._load_archive(diskpath, parts[:-1], stamp)
+            data = get_member(parent, parts[-1]) if parent is not None else None
+            if data is None:
+                raise FileNotFoundError(key)
+        else:
+            with open(diskpath, "rb") as f:
+                data = f.read()
+
+        archive, buffer = open_archive_data(data, self.cache)
+        if archive is None:
+            raise RuntimeError("{0} is not a Yaz0, SARC or RARC archive".format(key))
+
+        if parts and buffer is data:
+            # Archives in archives that aren't compressed are a view into the archive they are in which is already counted
+            size = 0
+            self._views[key] = "/".join([diskpath] + parts[:-1])
+        else:
+            size = len(buffer)
+        self._archives[key] = (stamp, archive, size)
+        self._size += size
+        self._evict(key)
+
+        return archive
+
+    def _evict(self, keep):
+        while self._size > self.max_size:
+            # The least recently used archive that no cached archive is a view into
+            pinned = set(self._views.values())
+            for key in self._archives:
+                if key != keep and key not in pinned:
+                    break
+            else:
+                break
+
+            stamp, archive, size = self._archives.pop(key)
+            self._views.pop(key, None)
+            self._size -= size
+
+    def _resolve(self, path):
+        # Returns the path of the file on disk that path starts in with its size and modification time,
+        # the paths of the archives in it that lead to the last archive in path, that archive and the path of
+        # the file in it. For files that aren't in an archive the archive and the file path are None.
+        diskpath, parts = split_path(path)
+        stamp = self._get_stamp(diskpath)
+        if not parts:
+            return diskpath, stamp, [], None, None
+
+        archiveparts = []
+        while True:
+            archive = self._load_archive(diskpath, archiveparts, stamp)
+
+            # Find the shortest path that is a file in the archive, if there is more of the path left
+            # the file has to be an archive as well.
+            for i in range(1, len(parts)+1):
+                member = "/".join(parts[:i])
+                if i == len(parts) or get_member(archive, member) is not None:
+                    break
+
+            if i == len(parts):
+                return diskpath, stamp, archiveparts, archive, member
+
+            archiveparts.append(member)
+            parts = parts[i:]
+
+    def get_archive(self, path):
+        # Returns the archive at path, which can be on disk or in another archive
+        diskpath, stamp, archiveparts, archive, member = self._resolve(path)
+        if member is not None:
+            archiveparts = archiveparts + [member]
+
+        return self._load_archive(diskpath, archiveparts, stamp)
+
+    def read(self, path):
+        # Returns the data of the file at path, for files in archives it is a read-only view
+        diskpath, stamp, archiveparts, archive, member = self._resolve(path)
+        if archive is None:
+            with open(diskpath, "rb") as f:
+                return f.read()
+
+        data = get_member(archive, member)
+        if data is None:
+            raise FileNotFoundError(path)
+        return data
+
+    def open(self, path):
+        return BytesIO(self.read(path))
+
+    def exists(self, path):
+        try:
+            self.read(path)
+        except (FileNotFoundError, KeyError, RuntimeError):
+            return False
+        return True
+
+    def listdir(self, path):
+        # Paths of all files in the archive at path
+        return list_members(self.get_archive(path))
+
+    def iter_files(self, path):
+        # Yields the path and a view of the data of each file in the archive at path
+        archive = self.get_archive(path)
+        for member in list_members(archive):
+            yield member, get_member(archive, member)
+
+    def invalidate(self, path=None):
+        # Drops the cached archives that come from the file at path, or all of them if path is None
+        if path is None:
+            self._archives.clear()
+            self._views.clear()
+            self._size = 0
+            return
+
+        path = path.replace("\\", "/")
+        for key in list(self._archives.keys()):
+            if key == path or key.startswith(path + "/"):
+                stamp, archive, size = self._archives.pop(key)
+                self._views.pop(key, None)
+                self._size -= size
+
+    def size(self):
+        return self._size
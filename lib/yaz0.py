@@ -3,19 +3,26 @@
 ## Implementation of a yaz0 decoder/encoder in Python, by Yoshi2
 ## Using the specifications in http://www.amnoid.de/gc/yaz0.txt
 
-from struct import unpack, pack
+from struct import unpack, unpack_from, pack
 import os
+import mmap
 import re
 import hashlib
 import math
 
 from timeit import default_timer as time
-from io import BytesIO
+from io import BytesIO, UnsupportedOperation
+from concurrent.futures import ProcessPoolExecutor
 #from cStringIO import StringIO
 
 #class yaz0():
 #    def __init__(self, inputobj, outputobj = None, compress = False):
 
+YAZ0_WINDOW = 0x1000
+YAZ0_MIN_MATCH = 3
+YAZ0_MAX_MATCH = 0xFF + 0x12
+
+
 def read_uint32(f):
     return unpack(">I", f.read(4))[0]
     
@@ -28,109 +35,248 @@ def read_uint16(f):
 def read_uint8(f):
     return f.read(1)[0]
 
-def write_limited(f, data, limit):
-    if f.tell() >= limit:
-        pass
-    else:
-        f.write(data)
-    
+def get_decompressed_size(data):
+    if bytes(data[0:4]) != b"Yaz0":
+        raise RuntimeError("File is not Yaz0-compressed! Header: {0}".format(bytes(data[0:4])))
+    return unpack_from(">I", data, 4)[0]
+
+
+def decompress_into(data, out):
+    # data can be anything that supports the buffer protocol, e.g. bytes or an mmap of the file.
+    # out needs to be a writable buffer (bytearray or memoryview) of at least the decompressed size.
+    decompressed_size = get_decompressed_size(data)
+
+    with memoryview(data) as src:
+        if isinstance(data, bytes):
+            # Indexing bytes directly is a bit faster than going through the memoryview
+            src = data
+
+        src_pos = 16
+        dst_pos = 0
+        src_end = len(src)
+
+        try:
+            while dst_pos < decompressed_size:
+                code_byte = src[src_pos]
+                src_pos += 1
+
+                if code_byte == 0xFF and dst_pos + 8 <= decompressed_size and src_pos + 8 <= src_end:
+                    # All 8 entries are literals, copy them in one go
+                    out[dst_pos:dst_pos+8] = src[src_pos:src_pos+8]
+                    src_pos += 8
+                    dst_pos += 8
+                    continue
+
+                for bit in (0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01):
+                    if dst_pos >= decompressed_size:
+                        break
+
+                    if code_byte & bit:
+                        out[dst_pos] = src[src_pos]  # Write next byte as-is without requiring decompression
+                        src_pos += 1
+                        dst_pos += 1
+                    else:
+                        byte1 = src[src_pos]
+                        byte2 = src[src_pos+1]
+                        src_pos += 2
+
+                        distance = ((byte1 & 0x0F) << 8 | byte2) + 1
+                        bytecount = byte1 >> 4
+                        if bytecount == 0:
+                            bytecount = src[src_pos] + 0x12
+                            src_pos += 1
+                        else:
+                            bytecount += 2
+
+                        copy_start = dst_pos - distance
+                        if copy_start < 0:
+                            raise RuntimeError("Malformed Yaz0 file: Seek back position goes below 0")
+
+                        if dst_pos + bytecount > decompressed_size:
+                            bytecount = decompressed_size - dst_pos
+
+                        if distance >= bytecount:
+                            out[dst_pos:dst_pos+bytecount] = out[copy_start:copy_start+bytecount]
+                        else:
+                            # Copy source and copy destination overlap which means the
+                            # copy source is repeated until the byte count is reached
+                            pattern = bytes(out[copy_start:dst_pos])
+                            out[dst_pos:dst_pos+bytecount] = (pattern*(bytecount//distance + 1))[:bytecount]
+
+                        dst_pos += bytecount
+        except IndexError:
+            raise RuntimeError("Didn't decompress correctly, input ended after {0}/{1} bytes of output".format(
+                dst_pos, decompressed_size))
+
+    return decompressed_size
+
+
+def decompress_data(data):
+    out = bytearray(get_decompressed_size(data))
+    decompress_into(data, out)
+    return out
+
+
+def decompress_bytesio(data):
+    # Decompresses straight into the buffer of a BytesIO so that the result
+    # can be handed to the archive parsers without copying it again.
+    result = BytesIO()
+    decompressed_size = get_decompressed_size(data)
+
+    if decompressed_size > 0:
+        result.seek(decompressed_size-1)
+        result.write(b"\x00")
+        view = result.getbuffer()
+        try:
+            decompress_into(data, view)
+        finally:
+            view.release()
+        result.seek(0)
+
+    return result
+
+
+def map_file(f):
+    # Returns a read-only mmap of the whole file, or None if f isn't backed by a file that can be mapped
+    try:
+        fileno = f.fileno()
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, UnsupportedOperation):
+        return None
+
+
+def read_buffer(f):
+    # Gives access to the whole content of f as a buffer without reading it into memory when possible
+    data = map_file(f)
+    if data is None:
+        if isinstance(f, BytesIO):
+            data = f.getbuffer()
+        else:
+            f.seek(0)
+            data = f.read()
+    return data
+
+
+def decompress_file(f):
+    # Maps the file into memory if possible instead of reading it
+    data = map_file(f)
+    if data is None:
+        f.seek(0)
+        return decompress_bytesio(f.read())
+
+    with data:
+        return decompress_bytesio(data)
+
+
+def decompress_buffer(f, cache=None):
+    # Like decompress_file but returns the decompressed data as a buffer. With a DecompressionCache the
+    # data is taken from the cache if the same file was decompressed before, it is an mmap then.
+    if cache is None:
+        return decompress_file(f).getbuffer()
+
+    data = map_file(f)
+    if data is None:
+        f.seek(0)
+        return cache.decompress_data(f.read())
+
+    with data:
+        return cache.decompress_data(data)
+
+
 def decompress(f, out):
-    #if out is None:
-    #    out = BytesIO()
-    
-    # A way to discover the total size of the input data that
-    # should be compatible with most file-like objects.
-    f.seek(0, 2)
-    maxsize = f.tell()
     f.seek(0)
-    
-    #data = f.read()
-    #assert len(data) == maxsize
-    #f.seek(0)
+    out.write(decompress_data(f.read()))
 
 
-    header = f.read(4)
-    if header != b"Yaz0":
-        raise RuntimeError("File is not Yaz0-compressed! Header: {0}".format(header))
-    
-    decompressed_size = read_uint32(f)
-    f.read(8) # padding
-        
-    eof = False
+def iter_decompress(f, chunk_size=0x10000):
+    # Decompresses the Yaz0 stream starting at the current position of f and yields the output in chunks
+    # of at least chunk_size bytes (except for the last one) as soon as they are ready. Only the
+    # sliding window and the current chunk are kept in memory, the input is read in blocks as well.
+    header = f.read(16)
+    decompressed_size = get_decompressed_size(header)
 
-    # Some micro optimization, can save up to a second on bigger files
-    file_read = f.read
-    file_tell = f.tell
+    src = b""
+    src_pos = 0
+    read_size = max(chunk_size, 0x1000)
 
-    out_read = out.read
-    out_write = out.write
-    out_tell = out.tell
-    out_seek = out.seek
+    buf = bytearray()
+    flushed = 0  # Start of the part of buf that has not been yielded yet, everything before it is window
+    total = 0
 
-    range_8 = [i for i in range(8)]
+    try:
+        while total < decompressed_size:
+            # One code byte and its 8 entries need at most 1 + 8*3 bytes of input
+            if len(src) - src_pos < 25:
+                src = src[src_pos:] + f.read(read_size)
+                src_pos = 0
 
-    while out_tell() < decompressed_size and not eof:
-        code_byte = file_read(1)[0]
-        
-        for i in range_8:
-            #is_set = ((code_byte << i) & 0x80) != 0
-            
-            if (code_byte << i) & 0x80:
-                out_write(file_read(1)) # Write next byte as-is without requiring decompression
-            else:
-                if file_tell() >= maxsize-1:
-                    eof = True
-                    break
+            code_byte = src[src_pos]
+            src_pos += 1
 
-                data = file_read(2)
-                infobyte = data[0] << 8 | data[1]
-                
+            for bit in (0x80, 0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01):
+                if total >= decompressed_size:
+                    break
 
-                bytecount = infobyte >> 12 
-                
-                if bytecount == 0:
-                    if file_tell() > maxsize-1:
-                        eof = True
-                        break
-                    bytecount = file_read(1)[0] + 0x12
+                if code_byte & bit:
+                    buf.append(src[src_pos])
+                    src_pos += 1
+                    total += 1
                 else:
-                    bytecount += 2
-                
-                offset = infobyte & 0x0FFF
-                
-                current = out_tell()
-                seekback = current - (offset+1)
-                
-                if seekback < 0:
-                    raise RuntimeError("Malformed Yaz0 file: Seek back position goes below 0")
-
-                out_seek(seekback)
-                copy = out_read(bytecount)
-                out_seek(current)
-                
-                write_limited(out, copy, decompressed_size)
-
-                copy_length = len(copy)
-                
-                if copy_length < bytecount:
-                    # Copy source and copy distance overlap which essentially means that
-                    # we have to repeat the copied source to make up for the difference
-                    j = 0
-                    for i in range(bytecount-copy_length):
-                        #write_limited(out, copy[j:j+1], decompressed_size)
-                        if out_tell() < decompressed_size:
-                            out_write(copy[j:j+1])
-                        else:
-                            break
+                    byte1 = src[src_pos]
+                    byte2 = src[src_pos+1]
+                    src_pos += 2
+
+                    distance = ((byte1 & 0x0F) << 8 | byte2) + 1
+                    bytecount = byte1 >> 4
+                    if bytecount == 0:
+                        bytecount = src[src_pos] + 0x12
+                        src_pos += 1
+                    else:
+                        bytecount += 2
+
+                    copy_start = len(buf) - distance
+                    if copy_start < 0:
+                        raise RuntimeError("Malformed Yaz0 file: Seek back position goes below 0")
+
+                    if total + bytecount > decompressed_size:
+                        bytecount = decompressed_size - total
+
+                    if distance >= bytecount:
+                        buf += buf[copy_start:copy_start+bytecount]
+                    else:
+                        pattern = bytes(buf[copy_start:])
+                        buf += (pattern*(bytecount//distance + 1))[:bytecount]
+
+                    total += bytecount
+
+            if len(buf) - flushed >= chunk_size:
+                yield bytes(buf[flushed:])
+
+                if len(buf) > YAZ0_WINDOW:
+                    del buf[:len(buf)-YAZ0_WINDOW]
+                flushed = len(buf)
+
+    except IndexError:
+        raise RuntimeError("Didn't decompress correctly, input ended after {0}/{1} bytes of output".format(
+            total, decompressed_size))
+
+    if len(buf) > flushed:
+        yield bytes(buf[flushed:])
 
-                        j = (j+1) % copy_length
-                
-    if out.tell() < decompressed_size:
-        #print("this isn't right")
-        raise RuntimeError("Didn't decompress correctly, notify the developer!")
-    if out.tell() > decompressed_size:
-        print(  "Warning: output is longer than decompressed size for some reason: "
-                "{}/decompressed: {}".format(out.tell(), decompressed_size))
+
+def decompress_prefix(f, nbytes, chunk_size=0x1000):
+    # Decompresses only as much of the Yaz0 stream as is needed to get the first nbytes of output
+    out = bytearray()
+    stream = iter_decompress(f, chunk_size)
+    try:
+        for chunk in stream:
+            out += chunk
+            if len(out) >= nbytes:
+                break
+    finally:
+        stream.close()
+
+    return bytes(out[:nbytes])
 
 
 def compress_fast(f, out):
@@ -158,3 +304,455 @@ def compress_fast(f, out):
         
         out_write(b"\xFF") # Set all bits in the code byte to 1 to mark the following 8 bytes as copy
         out_write(tocopy)
+
+
+# Compression levels for compress(). Each level is a tuple of
+# (max hash chain steps, lazy matching, longest match whose positions are still added to the hash chains).
+# Level 0 writes literals only, 1-3 are greedy, 4 and up do one step of lazy matching.
+COMPRESSION_LEVELS = {
+    0: (0, False, 0),
+    1: (4, False, 8),
+    2: (8, False, 16),
+    3: (32, False, 32),
+    4: (16, True, 16),
+    5: (32, True, 32),
+    6: (128, True, 128),
+    7: (256, True, YAZ0_MAX_MATCH),
+    8: (1024, True, YAZ0_MAX_MATCH),
+    9: (4096, True, YAZ0_MAX_MATCH)
+}
+DEFAULT_LEVEL = 6
+# Smallest amount of data compress_parallel gives to one process
+MIN_SEGMENT_SIZE = 0x40000
+# Default size limit of a CompressionCache in bytes
+DEFAULT_CACHE_SIZE = 256*1024*1024
+
+
+def _check_level(level):
+    if level not in COMPRESSION_LEVELS:
+        raise ValueError("Unknown compression level {0}, should be one of {1}".format(
+            level, sorted(COMPRESSION_LEVELS.keys())))
+
+
+def _encode_items(data, start=0, level=DEFAULT_LEVEL):
+    # Finds the literals and back-references for data[start:], data[:start] is only used as history
+    # that back-references can point into. Returns the entries as two bytearrays: for every entry
+    # its kind (1 = literal, 2 = back-reference with 2 bytes, 3 = back-reference with 3 bytes,
+    # which is also its size in bytes) and the encoded bytes of all entries back to back.
+    # The code bytes are added by _pack_items.
+    max_chain, lazy, max_insert = COMPRESSION_LEVELS[level]
+    if not isinstance(data, bytes):
+        data = bytes(data)
+    size = len(data)
+
+    kinds = bytearray()
+    out = bytearray()
+
+    # Hash chains over 3-byte prefixes. head maps a prefix to the most recent position it was seen at,
+    # prev is a ring buffer the size of the window that links each position to the previous one with
+    # the same prefix. Positions that fall out of the window end the chain.
+    head = {}
+    prev = [-1]*YAZ0_WINDOW
+    window_mask = YAZ0_WINDOW - 1
+    head_get = head.get
+    last_insert = size - YAZ0_MIN_MATCH
+
+    def insert(pos):
+        key = data[pos:pos+3]
+        prev[pos & window_mask] = head_get(key, -1)
+        head[key] = pos
+
+    def find_match(pos):
+        max_len = size - pos
+        if max_len > YAZ0_MAX_MATCH:
+            max_len = YAZ0_MAX_MATCH
+        if max_len < YAZ0_MIN_MATCH:
+            return 0, 0
+
+        limit = pos - YAZ0_WINDOW
+        candidate = head_get(data[pos:pos+3], -1)
+        best_len = YAZ0_MIN_MATCH - 1
+        best_pos = 0
+        steps = max_chain
+
+        while candidate >= limit and candidate >= 0 and steps > 0:
+            steps -= 1
+            # A candidate can only beat the best match if it agrees on the byte that would extend it
+            if data[candidate+best_len] == data[pos+best_len]:
+                length = 0
+                while length < max_len and data[candidate+length] == data[pos+length]:
+                    length += 1
+
+                if length > best_len:
+                    best_len = length
+                    best_pos = candidate
+                    if length == max_len:
+                        break
+
+            candidate = prev[candidate & window_mask]
+
+        if best_len < YAZ0_MIN_MATCH:
+            return 0, 0
+        return best_len, best_pos
+
+    pos = start
+    next_insert = start
+    pending = None
+
+    if max_chain > 0:
+        for i in range(max(0, start-YAZ0_WINDOW), min(start, last_insert+1)):
+            insert(i)
+
+    while pos < size:
+        if pending is not None:
+            match_len, match_pos = pending
+            pending = None
+        elif max_chain > 0:
+            match_len, match_pos = find_match(pos)
+        else:
+            match_len = 0
+
+        if match_len and lazy and match_len < YAZ0_MAX_MATCH and pos < last_insert:
+            # Check if starting the match one byte later gives a longer match,
+            # if so the current byte is written as a literal and the later match is used.
+            if next_insert <= pos:
+                insert(pos)
+                next_insert = pos + 1
+            pending = find_match(pos+1)
+            if pending[0] > match_len:
+                match_len = 0
+            else:
+                pending = None
+
+        if match_len:
+            distance = pos - match_pos - 1
+            if match_len >= 0x12:
+                out.append(distance >> 8)
+                out.append(distance & 0xFF)
+                out.append(match_len - 0x12)
+                kinds.append(3)
+            else:
+                out.append(((match_len - 2) << 4) | (distance >> 8))
+                out.append(distance & 0xFF)
+                kinds.append(2)
+
+            end = pos + match_len
+            if max_chain > 0:
+                if match_len <= max_insert:
+                    for i in range(next_insert, min(end, last_insert+1)):
+                        insert(i)
+                elif next_insert <= pos:
+                    insert(pos)
+            next_insert = end
+            pos = end
+        else:
+            out.append(data[pos])
+            kinds.append(1)
+            if max_chain > 0 and next_insert <= pos and pos <= last_insert:
+                insert(pos)
+            pos += 1
+            if next_insert < pos:
+                next_insert = pos
+
+    return kinds, out
+
+
+def _make_code_bytes():
+    # Maps the literal flags of 8 entries (one byte each, 1 for a literal) to the code byte
+    code_bytes = {}
+    for code_byte in range(256):
+        flags = bytes((code_byte >> (7-i)) & 1 for i in range(8))
+        code_bytes[flags] = code_byte
+    return code_bytes
+
+
+_CODE_BYTES = _make_code_bytes()
+_KIND_TO_FLAG = bytes([0, 1, 0, 0]) + bytes(252)
+
+
+def _pack_items(out, kinds, payload):
+    # Writes the entries produced by _encode_items to out in groups of 8 with a code byte in front
+    count = len(kinds)
+    payload_pos = 0
+
+    for i in range(0, count, 8):
+        group = kinds[i:i+8]
+        flags = group.translate(_KIND_TO_FLAG)
+        if len(flags) < 8:
+            flags = flags + bytes(8 - len(flags))
+        out.append(_CODE_BYTES[bytes(flags)])
+
+        group_size = sum(group)
+        out += payload[payload_pos:payload_pos+group_size]
+        payload_pos += group_size
+
+
+def _write_header(out, size):
+    out += b"Yaz0"
+    out += pack(">I", size)
+    out += b"\x00"*8
+
+
+def compress_data(data, level=DEFAULT_LEVEL):
+    _check_level(level)
+
+    out = bytearray()
+    _write_header(out, len(data))
+    kinds, payload = _encode_items(data, 0, level)
+    _pack_items(out, kinds, payload)
+
+    return out
+
+
+def compress_parallel(data, workers=None, level=DEFAULT_LEVEL, segment_size=None):
+    # Splits the data into segments that are compressed in separate processes. Each segment
+    # can still use the 0x1000 bytes preceding it as history so only the first few matches after a segment
+    # boundary get worse. The entries of all segments are then put into one valid Yaz0 stream.
+    _check_level(level)
+    if not isinstance(data, bytes):
+        data = bytes(data)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if segment_size is None:
+        segment_size = max(MIN_SEGMENT_SIZE, -(-len(data) // workers))
+
+    out = bytearray()
+    _write_header(out, len(data))
+
+    if workers <= 1 or len(data) <= segment_size:
+        kinds, payload = _encode_items(data, 0, level)
+        _pack_items(out, kinds, payload)
+        return out
+
+    segments = []
+    for start in range(0, len(data), segment_size):
+        history = max(0, start - YAZ0_WINDOW)
+        segments.append((data[history:start+segment_size], start - history))
+
+    kinds = bytearray()
+    payload = bytearray()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = [executor.submit(_encode_items, segment, start, level) for segment, start in segments]
+        for result in results:
+            segment_kinds, segment_payload = result.result()
+            kinds += segment_kinds
+            payload += segment_payload
+
+    _pack_items(out, kinds, payload)
+    return out
+
+
+class Yaz0Writer(object):
+    # File-like object that compresses the data written to it and passes the Yaz0 data on to out as it goes,
+    # so out doesn't need to be seekable. The decompressed size is part of the header so it has to be known
+    # in advance. Like compress_parallel, the data is compressed in segments that can use the 0x1000 bytes
+    # before them as history, so only about segment_size bytes of uncompressed data are held at a time.
+    def __init__(self, out, size, level=DEFAULT_LEVEL, segment_size=MIN_SEGMENT_SIZE):
+        _check_level(level)
+        self.out = out
+        self.size = size
+        self.level = level
+        self.segment_size = segment_size
+
+        self._buffer = bytearray()
+        self._history = 0  # Bytes at the start of the buffer that were already compressed
+        self._kinds = bytearray()  # Entries that don't fill a group of 8 yet
+        self._payload = bytearray()
+        self._written = 0
+
+        header = bytearray()
+        _write_header(header, size)
+        out.write(header)
+
+    def write(self, data):
+        self._written += len(data)
+        if self._written > self.size:
+            raise RuntimeError("Got more data than the size in the Yaz0 header: {0}".format(self.size))
+
+        self._buffer += data
+        while len(self._buffer) - self._history >= self.segment_size:
+            self._compress_segment(self._history + self.segment_size)
+
+        return len(data)
+
+    def tell(self):
+        return self._written
+
+    def _compress_segment(self, end):
+        kinds, payload = _encode_items(bytes(self._buffer[:end]), self._history, self.level)
+        self._kinds += kinds
+        self._payload += payload
+
+        # Only complete groups can be written, the rest waits for the next segment
+        group_end = len(self._kinds) & ~7
+        payload_size = sum(self._kinds[:group_end])
+        out = bytearray()
+        _pack_items(out, self._kinds[:group_end], self._payload[:payload_size])
+        self.out.write(out)
+        del self._kinds[:group_end]
+        del self._payload[:payload_size]
+
+        history_start = max(0, end - YAZ0_WINDOW)
+        del self._buffer[:history_start]
+        self._history = end - history_start
+
+    def close(self):
+        if self._written != self.size:
+            raise RuntimeError("Got {0} bytes but the size in the Yaz0 header is {1}".format(self._written, self.size))
+
+        if len(self._buffer) > self._history:
+            self._compress_segment(len(self._buffer))
+
+        out = bytearray()
+        _pack_items(out, self._kinds, self._payload)
+        self.out.write(out)
+        self._kinds = bytearray()
+        self._payload = bytearray()
+
+
+def _compress_data(data, level, workers):
+    if workers == 1:
+        return compress_data(data, level)
+    else:
+        return compress_parallel(data, workers, level)
+
+
+class FileCache(object):
+    # Base for the on-disk caches. Entries are files with the given ending in the cache directory,
+    # the modification time of an entry is updated whenever it is used and the least recently used
+    # entries are removed once the cache grows over max_size bytes.
+    ending = ".bin"
+
+    def __init__(self, path, max_size=DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def _write_entry(self, entry_path, data):
+        tmp_path = "{0}.{1}.tmp".format(entry_path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        try:
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            # On Windows an entry that is still mapped into memory can't be replaced, it is up to date anyway
+            os.remove(tmp_path)
+
+        self.evict()
+
+    def size(self):
+        return sum(size for path, size, mtime in self._entries())
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and entry.name.endswith(self.ending):
+                stat = entry.stat()
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self):
+        entries = self._entries()
+        total = sum(size for path, size, mtime in entries)
+        if total <= self.max_size:
+            return
+
+        entries.sort(key=lambda entry: entry[2])
+        for path, size, mtime in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Already gone, or still mapped into memory on Windows
+                continue
+            total -= size
+
+    def clear(self):
+        for path, size, mtime in self._entries():
+            os.remove(path)
+
+
+class CompressionCache(FileCache):
+    # On-disk cache of Yaz0 compressed data, keyed by the hash of the uncompressed data and the compression level.
+    ending = ".yaz0"
+
+    def _entry_path(self, data, level):
+        digest = hashlib.sha1(data).hexdigest()
+        return os.path.join(self.path, "{0}_{1}.yaz0".format(digest, level))
+
+    def get(self, data, level=DEFAULT_LEVEL):
+        entry_path = self._entry_path(data, level)
+        try:
+            with open(entry_path, "rb") as f:
+                compressed = f.read()
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+
+        # Don't trust an entry that doesn't describe data of the right size, e.g. if it was cut short
+        if len(compressed) < 16 or get_decompressed_size(compressed) != len(data):
+            return None
+
+        return compressed
+
+    def put(self, data, level, compressed):
+        self._write_entry(self._entry_path(data, level), compressed)
+
+    def compress_data(self, data, level=DEFAULT_LEVEL, workers=1):
+        _check_level(level)
+        if not isinstance(data, bytes):
+            data = bytes(data)
+
+        compressed = self.get(data, level)
+        if compressed is None:
+            compressed = _compress_data(data, level, workers)
+            self.put(data, level, compressed)
+
+        return compressed
+
+
+class DecompressionCache(FileCache):
+    # On-disk cache of decompressed Yaz0 data, keyed by the hash of the compressed data.
+    # Entries are memory-mapped when they are loaded so they don't have to be read in full.
+    ending = ".bin"
+
+    def _entry_path(self, data):
+        digest = hashlib.sha1(data).hexdigest()
+        return os.path.join(self.path, "{0}.bin".format(digest))
+
+    def get(self, data):
+        # Returns a read-only mmap of the decompressed data, or None if it isn't cached
+        entry_path = self._entry_path(data)
+        try:
+            with open(entry_path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                # Don't trust an entry that doesn't have the right size, e.g. if it was cut short
+                if size == 0 or size != get_decompressed_size(data):
+                    return None
+                decompressed = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+
+        return decompressed
+
+    def put(self, data, decompressed):
+        self._write_entry(self._entry_path(data), decompressed)
+
+    def decompress_data(self, data):
+        decompressed = self.get(data)
+        if decompressed is None:
+            decompressed = decompress_data(data)
+            self.put(data, decompressed)
+
+        return decompressed
+
+
+def compress(f, out, level=DEFAULT_LEVEL, workers=1, cache=None):
+    if cache is not None:
+        out.write(cache.compress_data(f.read(), level, workers))
+    else:
+        out.write(_compress_data(f.read(), level, workers))
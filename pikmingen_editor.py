@@ -1,3 +1,4 @@
+import os
 import traceback
 from copy import deepcopy
 from timeit import default_timer
@@ -29,15 +30,22 @@ from widgets.side_widget import PikminSideWidget
 from widgets.editor_widgets import PikObjectEditor, open_error_dialog, catch_exception_with_dialog
 from pikmingen_widgets import GenMapViewer, MODE_TOPDOWN
 from lib.sarc import SARCArchive
+from lib.yaz0 import CompressionCache, DecompressionCache
+from lib.vfs import ArchiveFS, DEFAULT_MAX_SIZE
 from lib.libpath import Paths, Waypoint
+from lib.snapshot import SnapshotCache
+from lib.objectstore import translate, set_heights
 
 from widgets.file_select import FileSelect
 
+YAZ0_CACHE_PATH = os.path.join("cache", "yaz0")
+ARCHIVE_CACHE_PATH = os.path.join("cache", "archives")
+SNAPSHOT_CACHE_PATH = os.path.join("cache", "snapshots")
 PIKMIN2GEN = "Generator files (defaultgen.txt;initgen.txt;plantsgen.txt;*.txt)"
 
 
 class GenEditor(QMainWindow):
-    def __init__(self):
+    def __init__(self, archive_cache=True):
         super().__init__()
         self.pikmin_gen_file = GeneratorFile()
 
@@ -57,6 +65,22 @@ class GenEditor(QMainWindow):
         self.editorconfig = self.configuration["gen editor"]
         self.current_gen_path = None
 
+        # Saving an archive that hasn't changed since the last save reuses the compressed data
+        self.yaz0_cache = CompressionCache(YAZ0_CACHE_PATH)
+        # Archives are read through this so that opening the same archive again doesn't decompress it again,
+        # with archive_cache that also goes for archives that were opened before the editor was started.
+        if archive_cache:
+            decompression_cache = DecompressionCache(ARCHIVE_CACHE_PATH)
+        else:
+            decompression_cache = None
+        self.vfs = ArchiveFS(self.editorconfig.getint("archivecache_mb", fallback=DEFAULT_MAX_SIZE//(1024*1024))*1024*1024,
+                             decompression_cache)
+        # Generator and path files that were opened before are loaded from a snapshot instead of being parsed
+        self.snapshot_cache = SnapshotCache(SNAPSHOT_CACHE_PATH)
+        # Large generator files can be read in more than one process, each of them has to start a new
+        # Python interpreter (and import the editor again on Windows) so it is only worth it for huge files.
+        self.gen_read_workers = max(1, self.editorconfig.getint("gen_read_workers", fallback=1))
+
         self.current_coordinates = None
         self.editing_windows = {}
         self.add_object_window = None
@@ -400,15 +424,13 @@ class GenEditor(QMainWindow):
             self.last_gen_filter = choosentype
             self.last_gen_path = filepath
             if choosentype == "Archived files (*.arc, *.szs)" or filepath.endswith(".szs") or filepath.endswith(".arc"):
-                with open(filepath, "rb") as f:
-                    try:
-                        arc = SARCArchive.from_file(f)
-                    except Exception as error:
-                        print("Error appeared while loading:", error)
-                        traceback.print_exc()
-                        open_error_dialog(str(error), self)
-                        return
-                filepaths = [x for x in arc.files.keys()]
+                try:
+                    filepaths = self.vfs.listdir(filepath)
+                except Exception as error:
+                    print("Error appeared while loading:", error)
+                    traceback.print_exc()
+                    open_error_dialog(str(error), self)
+                    return
                 filepaths.sort()
                 file, lastpos = FileSelect.open_file_list(self, filepaths, title="Select file")
                 print("selected:", file)
@@ -418,13 +440,11 @@ class GenEditor(QMainWindow):
                     self.loaded_archive = None
                     return
 
-                genfile = arc.files[file]
-
                 try:
-                    pikmin_gen_file = GeneratorFile.from_file(
-                        TextIOWrapper(BytesIO(genfile.getvalue()), errors="replace")
+                    pikmin_gen_file = self.snapshot_cache.read_generator_file(
+                        TextIOWrapper(self.vfs.open(filepath + "/" + file), errors="replace").read(),
+                        self.gen_read_workers
                     )
-                    genfile.seek(0)
                     self.setup_gen_file(pikmin_gen_file, filepath, file)
 
                 except Exception as error:
@@ -435,7 +455,7 @@ class GenEditor(QMainWindow):
             else:
                 with open(filepath, "r", encoding="shift-jis-2004", errors="replace") as f:
                     try:
-                        pikmin_gen_file = GeneratorFile.from_file(f)
+                        pikmin_gen_file = self.snapshot_cache.read_generator_file(f.read(), self.gen_read_workers)
                         self.setup_gen_file(pikmin_gen_file, filepath)
 
                     except Exception as error:
@@ -454,24 +474,21 @@ class GenEditor(QMainWindow):
             self.last_path_path = filepath
             self.last_path_filter = choosentype
             if filepath.lower().endswith(".arc") or filepath.lower().endswith(".szs") or choosentype == "Archived Path file (*.szs)":
-                with open(filepath, "rb") as f:
-                    try:
-                        arc = SARCArchive.from_file(f)
-                    except Exception as error:
-                        print("Error appeared while loading:", error)
-                        traceback.print_exc()
-                        open_error_dialog(str(error), self)
-                        return
+                try:
+                    has_path = self.vfs.exists(filepath + "/path.txt")
+                except Exception as error:
+                    print("Error appeared while loading:", error)
+                    traceback.print_exc()
+                    open_error_dialog(str(error), self)
+                    return
 
-                if "path.txt" not in arc.files:
+                if not has_path:
                     open_error_dialog("SZS Archive does not contain 'path.txt'! Path file not loaded.", self)
                     return
 
                 try:
-                    path_raw = arc.files["path.txt"].getvalue()
-                    arc.files["path.txt"].seek(0)
-                    path_file = TextIOWrapper(BytesIO(path_raw), errors="replace")
-                    paths = Paths.from_file(path_file)
+                    path_file = TextIOWrapper(self.vfs.open(filepath + "/path.txt"), errors="replace")
+                    paths = self.snapshot_cache.read_paths(path_file.read())
                     self.loaded_paths = paths
                     self.pikmin_gen_view.waypoints.set_paths(self.loaded_paths)
                     self.pikmin_gen_view.do_redraw()
@@ -490,7 +507,7 @@ class GenEditor(QMainWindow):
             elif filepath.lower().endswith(".txt"):
                 with open(filepath, "r", encoding="shift_jis-2004") as f:
                     try:
-                        paths = Paths.from_file(f)
+                        paths = self.snapshot_cache.read_paths(f.read())
                         self.loaded_paths = paths
                         self.pikmin_gen_view.waypoints.set_paths(self.loaded_paths)
                         self.pikmin_gen_view.do_redraw()
@@ -507,32 +524,18 @@ class GenEditor(QMainWindow):
 
         if filepath:
             if filepath.lower().endswith(".arc") or filepath.lower().endswith(".szs"):
-                with open(filepath, "rb") as f:
-                    try:
-                        arc = SARCArchive.from_file(f)
-                    except Exception as error:
-                        print("Error appeared while loading:", error)
-                        traceback.print_exc()
-                        open_error_dialog(str(error), self)
-                        return
-
-                if "path.txt" not in arc.files:
-                    open_error_dialog("SZS Archive does not contain 'path.txt'! Path file not saved.", self)
-                    return
-
                 try:
-                    path_raw = arc.files["path.txt"].getvalue()
-                    arc.files["path.txt"].seek(0)
                     tmp = StringIO()
                     self.loaded_paths.write(tmp)
-                    arc.files["path.txt"].write(tmp.getvalue().encode(encoding="shift-jis-2004", errors="backslashreplace"))
-                    arc.files["path.txt"].seek(0)
-
-                    with open(filepath, "wb") as f:
-                        arc.to_file(f, compress=filepath.endswith(".szs"))
+                    result = SARCArchive.patch_member(
+                        filepath, "path.txt",
+                        tmp.getvalue().encode(encoding="shift-jis-2004", errors="backslashreplace"),
+                        cache=self.yaz0_cache)
 
                     #self.set_has_unsaved_changes(False)
-                    self.statusbar.showMessage("Saved to {0}".format(filepath))
+                    self.statusbar.showMessage("Saved to {0} ({1})".format(filepath, result))
+                except KeyError:
+                    open_error_dialog("SZS Archive does not contain 'path.txt'! Path file not saved.", self)
                 except Exception as error:
                     print("Error appeared while loading:", error)
                     traceback.print_exc()
@@ -556,7 +559,7 @@ class GenEditor(QMainWindow):
             if filepath.lower().endswith(".arc") or filepath.lower().endswith(".szs"):
                 with open(filepath, "rb") as f:
                     try:
-                        arc = SARCArchive.from_file(f)
+                        arc = SARCArchive.from_file(f, lazy=True, use_mmap=False)
                     except Exception as error:
                         print("Error appeared while loading:", error)
                         traceback.print_exc()
@@ -568,16 +571,12 @@ class GenEditor(QMainWindow):
                     return
 
                 try:
-                    path_raw = arc.files["path.txt"].getvalue()
-                    arc.files["path.txt"].seek(0)
                     tmp = StringIO()
                     self.loaded_paths.write(tmp)
-                    arc.files["path.txt"].write(
-                        tmp.getvalue().encode(encoding="shift-jis-2004", errors="backslashreplace"))
-                    arc.files["path.txt"].seek(0)
+                    arc.set_file_data("path.txt", tmp.getvalue().encode(encoding="shift-jis-2004", errors="backslashreplace"))
 
                     with open(filepath, "wb") as f:
-                        arc.to_file(f, compress=filepath.endswith(".szs"))
+                        arc.to_file(f, compress=filepath.endswith(".szs"), cache=self.yaz0_cache)
 
                     # self.set_has_unsaved_changes(False)
                     self.statusbar.showMessage("Saved to {0}".format(filepath))
@@ -616,25 +615,17 @@ class GenEditor(QMainWindow):
     def button_save_level(self, *args, **kwargs):
         if self.current_gen_path is not None:
             if self.current_gen_path.lower().endswith(".arc") or self.current_gen_path.lower().endswith(".szs"):
-                with open(self.current_gen_path, "rb") as f:
-                    arc = SARCArchive.from_file(f)
                 #assert self.loaded_archive_file is not None
-
-
-
-                file = arc.files[self.loaded_archive_file]
-                file.seek(0)
                 tmp = StringIO()
                 writer = GeneratorWriter(tmp)
                 self.pikmin_gen_file.write(writer)
-                file.write(tmp.getvalue().encode(encoding="shift-jis-2004", errors="backslashreplace"))
-                file.seek(0)
-
-                with open(self.current_gen_path, "wb") as f:
-                    arc.to_file(f, compress=self.current_gen_path.endswith(".szs"))
+                result = SARCArchive.patch_member(
+                    self.current_gen_path, self.loaded_archive_file,
+                    tmp.getvalue().encode(encoding="shift-jis-2004", errors="backslashreplace"),
+                    cache=self.yaz0_cache)
 
                 self.set_has_unsaved_changes(False)
-                self.statusbar.showMessage("Saved to {0}".format(self.current_gen_path))
+                self.statusbar.showMessage("Saved to {0} ({1})".format(self.current_gen_path, result))
 
             else:
                 with open(self.current_gen_path, "w", encoding="shift-jis-2004", errors="backslashreplace") as f:
@@ -658,7 +649,7 @@ class GenEditor(QMainWindow):
             self.last_gen_filter = choosentype
             if choosentype == "Archived files (*.arc, *.szs)" or filepath.endswith(".arc") or filepath.endswith(".szs"):
                 with open(filepath, "rb") as f:
-                    arc = SARCArchive.from_file(f)
+                    arc = SARCArchive.from_file(f, lazy=True, use_mmap=False)
 
                 filepaths = [x for x in arc.files.keys()]
                 filepaths.sort()
@@ -669,15 +660,12 @@ class GenEditor(QMainWindow):
                 if filen is None:
                     return
 
-                file = arc.files[filen]
-                file.seek(0)
                 tmp = StringIO()
                 writer = GeneratorWriter(tmp)
                 self.pikmin_gen_file.write(writer)
-                file.write(tmp.getvalue().encode(encoding="shift-jis-2004", errors="backslashreplace"))
-                file.seek(0)
+                arc.set_file_data(filen, tmp.getvalue().encode(encoding="shift-jis-2004", errors="backslashreplace"))
                 with open(filepath, "wb") as f:
-                    arc.to_file(f, compress=filepath.endswith(".szs"))
+                    arc.to_file(f, compress=filepath.endswith(".szs"), cache=self.yaz0_cache)
 
                 self.set_has_unsaved_changes(False)
                 self.statusbar.showMessage("Saved to {0}".format(filepath))
@@ -726,19 +714,16 @@ class GenEditor(QMainWindow):
                 "Pikmin 3 Archive (*.szs);;Pikmin 3 Map Collision (*.bjmp);;All files (*)")
             if filepath:
                 if choosentype == "Pikmin 3 Archive (*.szs)" or filepath.endswith(".szs"):
-                    with open(filepath, "rb") as f:
-                        sarc = SARCArchive.from_file(f)
                     verts = []
                     faces = []
 
-                    for path, file in sarc.files.items():
+                    for path, data in self.vfs.iter_files(filepath):
                         if path.endswith(".bjmp"):
-                            collision = py_obj.BJMP(file)
+                            collision = py_obj.BJMP(BytesIO(data))
                             offset = len(verts)
                             for v1,v2,v3 in collision.triangles:
                                 faces.append((v1+offset, v2+offset, v3+offset))
                             verts.extend(collision.vertices)
-                    del sarc
 
                 else:
                     with open(filepath, "rb") as f:
@@ -897,6 +882,7 @@ class GenEditor(QMainWindow):
     @catch_exception
     def action_move_objects(self, deltax, deltay, deltaz):
         updatePaths = False
+        translate(self.pikmin_gen_view.selected, deltax, deltay, deltaz)
         for obj in self.pikmin_gen_view.selected:
             """obj.x += deltax
             obj.z += deltaz
@@ -912,9 +898,6 @@ class GenEditor(QMainWindow):
                     y = self.pikmin_gen_view.collision.collide_ray_downwards(obj.x, obj.z)
                     obj.y = obj.position_y = round(y, 6)
                     obj.offset_y = 0"""
-            obj.position.x += deltax
-            obj.position.y += deltay
-            obj.position.z += deltaz
             if isinstance(obj, Waypoint):
                 updatePaths = True
 
@@ -1023,13 +1006,13 @@ class GenEditor(QMainWindow):
         self.set_has_unsaved_changes(True)
 
     def action_ground_objects(self):
-        for obj in self.pikmin_gen_view.selected:
-            if self.pikmin_gen_view.collision is None:
-                return None
-            height = self.pikmin_gen_view.collision.collide_ray_downwards(obj.position.x, obj.position.z)
+        if self.pikmin_gen_view.collision is None:
+            return None
 
-            if height is not None:
-                obj.position.y = height
+        heights = []
+        for obj in self.pikmin_gen_view.selected:
+            heights.append(self.pikmin_gen_view.collision.collide_ray_downwards(obj.position.x, obj.position.z))
+        set_heights(self.pikmin_gen_view.selected, heights)
 
         if len(self.pikmin_gen_view.selected) == 1:
             obj = self.pikmin_gen_view.selected[0]
@@ -1054,6 +1037,7 @@ class GenEditor(QMainWindow):
                     del self.editing_windows[obj]
 
             tobedeleted.append(obj)
+        # The rows of the deleted objects in the object stores are freed when the next frame is drawn
         self.pikmin_gen_view.selected = []
 
         self.pik_control.reset_info()
@@ -1409,6 +1393,8 @@ if __name__ == "__main__":
                         help="Path to collision to be loaded.")
     parser.add_argument("--waterbox", default=None,
                         help="Path to waterbox file to be loaded.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Don't keep decompressed archives in {0} for faster loading next time.".format(ARCHIVE_CACHE_PATH))
 
     args = parser.parse_args()
 
@@ -1423,7 +1409,7 @@ if __name__ == "__main__":
         #sys.stdout = f
         #sys.stderr = f
         print("Python version: ", sys.version)
-        pikmin_gui = GenEditor()
+        pikmin_gui = GenEditor(archive_cache=not args.no_cache)
         pikmin_gui.setWindowIcon(QtGui.QIcon('resources/icon.ico'))
 
         if args.inputgen is not None:
@@ -1447,9 +1433,7 @@ if __name__ == "__main__":
                 faces = [face[0] for face in collision.faces]
 
             elif args.collision.endswith(".szs") or args.collision.endswith(".arc"):
-                with open(args.collision, "rb") as f:
-                    archive = Archive.from_file(f)
-                f = archive["text/grid.bin"]
+                f = pikmin_gui.vfs.open(args.collision + "/text/grid.bin")
                 collision = py_obj.PikminCollision(f)
 
                 verts = collision.vertices
@@ -1466,14 +1450,9 @@ if __name__ == "__main__":
                     waterboxfile = WaterboxTxt()
                     waterboxfile.from_file(f)
             elif args.waterbox.endswith(".szs") or args.waterbox.endwith(".arc"):
-                with open(args.waterbox, "rb") as f:
-                    archive = Archive.from_file(f)
-                    # try:
-                    f = archive["text/waterbox.txt"]
-                    # print(f.read())
-                    f.seek(0)
-                    waterboxfile = WaterboxTxt()
-                    waterboxfile.from_file(TextIOWrapper(f, encoding="shift_jis-2004", errors="backslashreplace"))
+                f = pikmin_gui.vfs.open(args.waterbox + "/text/waterbox.txt")
+                waterboxfile = WaterboxTxt()
+                waterboxfile.from_file(TextIOWrapper(f, encoding="shift_jis-2004", errors="backslashreplace"))
             else:
                 raise RuntimeError("Unknown waterbox file type:", args.waterbox)
 
@@ -31,6 +31,7 @@ from gizmo import Gizmo
 from lib.object_models import ObjectModels, WaypointsGraphics
 from editor_controls import UserControl
 from lib.libpath import Paths, Waypoint
+from lib.objectstore import ObjectStore
 import numpy
 
 MOUSE_MODE_NONE = 0
@@ -198,6 +199,10 @@ class GenMapViewer(QtWidgets.QOpenGLWidget):
         self.models = ObjectModels()
         self.grid = Grid(10000, 10000)
         self.waypoints = WaypointsGraphics()
+        # Positions and rotations of the generators and waypoints that are drawn. Each frame they are read
+        # from here for all objects at once, selections are moved and grounded on the arrays.
+        self.generator_store = ObjectStore()
+        self.waypoint_store = ObjectStore()
 
         self.modelviewmatrix = None
         self.projectionmatrix = None
@@ -537,6 +542,10 @@ class GenMapViewer(QtWidgets.QOpenGLWidget):
 
         self.gizmo_scale = gizmo_scale
 
+        if self.pikmin_generators is not None:
+            object_positions, object_rotations = self.generator_store.get_transforms(self.pikmin_generators.generators)
+        waypoint_positions = self.waypoint_store.get_transforms(self.waypoints.paths.waypoints)[0]
+
         #print(self.gizmo.position, campos)
         do_rotation = False
         for selected in self.selected:
@@ -569,10 +578,10 @@ class GenMapViewer(QtWidgets.QOpenGLWidget):
                 objects = self.pikmin_generators.generators
                 glDisable(GL_TEXTURE_2D)
                 for i, pikminobject in enumerate(objects):
-                    self.models.render_object_coloredid(pikminobject, i*2)
+                    self.models.render_object_coloredid(pikminobject, object_positions[i], object_rotations[i], i*2)
 
                 for i, waypoint in enumerate(self.waypoints.paths.waypoints):
-                    self.models.render_waypoint_coloredid(waypoint, i*2+1)
+                    self.models.render_waypoint_coloredid(waypoint, waypoint_positions[i], i*2+1)
 
                 pixels = glReadPixels(click_x, click_y, clickwidth, clickheight, GL_RGB, GL_UNSIGNED_BYTE)
                 #print(pixels, click_x, click_y, clickwidth, clickheight)
@@ -646,13 +655,14 @@ class GenMapViewer(QtWidgets.QOpenGLWidget):
 
             objects = self.pikmin_generators.generators
 
-            for pikminobject in objects:
-                self.models.render_object(pikminobject, pikminobject in selected)
+            for i, pikminobject in enumerate(objects):
+                self.models.render_object(pikminobject, object_positions[i], object_rotations[i],
+                                          pikminobject in selected)
 
         glDisable(GL_TEXTURE_2D)
 
-        for waypoint in self.waypoints.paths.waypoints:
-            self.models.render_waypoint(waypoint, waypoint in selected)
+        for i, waypoint in enumerate(self.waypoints.paths.waypoints):
+            self.models.render_waypoint(waypoint, waypoint_positions[i], waypoint in selected)
         self.waypoints.render(self.models)
         """glColor4f(0.0, 1.0, 0.0, 1.0)
         rendered = {}
@@ -688,11 +698,13 @@ class GenMapViewer(QtWidgets.QOpenGLWidget):
             selected = self.selected
             objects = self.pikmin_generators.generators
 
-            for pikminobject in objects:
+            for i, pikminobject in enumerate(objects):
                 if pikminobject.name == "WaterBox":
-                    scale = float(pikminobject.unknown_params["mScale"][0])
-                    depth = float(pikminobject.unknown_params["mDepth"][0])
-                    self.models.draw_waterbox(pikminobject.position, pikminobject.rotation.y,
+                    scale = pikminobject.get_param_float("mScale")
+                    depth = pikminobject.get_param_float("mDepth")
+                    if scale is None or depth is None:
+                        continue
+                    self.models.draw_waterbox(object_positions[i], object_rotations[i][1],
                                               scale * 100, scale * 100, depth,
                                               pikminobject in selected)
 
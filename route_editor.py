@@ -25,7 +25,8 @@ import PyQt5.QtWidgets as QtWidgets
 import PyQt5.QtCore as QtCore
 
 from libpiktxt import RouteTxt
-from lib.rarc import Archive
+from lib.vfs import ArchiveFS
+from lib.yaz0 import DecompressionCache
 
 import custom_widgets
 from custom_widgets import (MapViewer,
@@ -37,10 +38,11 @@ from py_obj import read_obj, PikminCollision
 from configuration import read_config, make_default_config, save_cfg
 
 PIKMIN2PATHS = "Carrying path files (route.txt;*.txt)"
+ARCHIVE_CACHE_PATH = os.path.join("cache", "archives")
 
 
 class EditorMainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, archive_cache=True):
         super().__init__()
 
         self.setupUi(self)
@@ -50,6 +52,7 @@ class EditorMainWindow(QMainWindow):
         self.pikminroutes_screen.pikmin_routes = self.pikmin_routes
         self.collision = None
         self.current_coordinates = None
+        self.vfs = ArchiveFS(cache=DecompressionCache(ARCHIVE_CACHE_PATH) if archive_cache else None)
 
         self.button_delete_waypoints.pressed.connect(self.action_button_delete_wp)
         self.button_ground_waypoints.pressed.connect(self.action_button_ground_wp)
@@ -225,11 +228,11 @@ class EditorMainWindow(QMainWindow):
             else:
                 load_from_arc = False
 
-            with open(filepath, "rb") as f:
-                if load_from_arc:
-                    archive = Archive.from_file(f)
-                    f = archive["text/grid.bin"]
-                collision = PikminCollision(f)
+            if load_from_arc:
+                collision = PikminCollision(self.vfs.open(filepath + "/text/grid.bin"))
+            else:
+                with open(filepath, "rb") as f:
+                    collision = PikminCollision(f)
 
 
             verts = collision.vertices
@@ -598,6 +601,8 @@ if __name__ == "__main__":
                         help="Path to route file to be loaded.")
     parser.add_argument("--collision", default=None,
                         help="Path to collision to be loaded.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Don't keep decompressed archives in {0} for faster loading next time.".format(ARCHIVE_CACHE_PATH))
 
     args = parser.parse_args()
 
@@ -608,7 +613,7 @@ if __name__ == "__main__":
         myappid = 'P2RoutesEditor'  # arbitrary string
         ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
 
-    route_gui = EditorMainWindow()
+    route_gui = EditorMainWindow(archive_cache=not args.no_cache)
     route_gui.setWindowIcon(QtGui.QIcon('resources/route_editor_icon.ico'))
 
     if args.inputroute is not None:
@@ -626,10 +631,7 @@ if __name__ == "__main__":
             faces = [face[0] for face in collision.faces]
 
         elif args.collision.endswith(".szs") or args.collision.endswith(".arc"):
-            with open(args.collision, "rb") as f:
-                archive = Archive.from_file(f)
-                f = archive["text/grid.bin"]
-                collision = PikminCollision(f)
+            collision = PikminCollision(route_gui.vfs.open(args.collision + "/text/grid.bin"))
 
             verts = collision.vertices
             faces = [face[0] for face in collision.faces]